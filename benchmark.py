@@ -0,0 +1,152 @@
+"""
+This script measures how long the per-frame drawing functions
+of the 'unpredictable flickering null-cue experiment' take per call,
+and how much memory they allocate while doing so.
+At 239 Hz there's only 4.2 ms per frame, so check this after changing any drawing code:
+
+    python benchmark.py             (compare against the saved baseline)
+    python benchmark.py --save      (save the results as the new baseline)
+    python benchmark.py --headless  (without a screen, only measures Python overhead)
+
+The script exits with an error if any function got slower than the baseline allows.
+
+made by Anna van Harmelen, 2024
+"""
+
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+from time import perf_counter
+import numpy as np
+from set_up import get_monitor_and_dir, get_settings
+from stimuli import create_stimuli_frame, create_probe_cue, create_fixation_dot
+from response import make_dial
+from trial import COLOURS, show_text
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "benchmark_baseline.json")
+
+
+def get_benchmarks(settings):
+    """Return every function to measure, each draws exactly one frame's worth."""
+    dial = make_dial(COLOURS[0], settings)
+    positions = settings["dial_trajectory"]["positions"][1]
+    turns = [0]
+
+    def redraw_dial():
+        dial_circle, top_dial, bottom_dial = dial
+        turns[0] = turns[0] % settings["monitor"]["Hz"] + 1
+        top_dial.pos = positions[turns[0], 0]
+        bottom_dial.pos = positions[turns[0], 1]
+
+        dial_circle.draw()
+        top_dial.draw()
+        bottom_dial.draw()
+        create_fixation_dot(settings)
+
+    return {
+        "create_stimuli_frame": lambda: create_stimuli_frame(
+            45, -45, COLOURS[:2], settings
+        ),
+        "create_probe_cue": lambda: create_probe_cue(COLOURS[0], settings),
+        "create_fixation_dot": lambda: create_fixation_dot(settings),
+        "make_dial": lambda: make_dial(COLOURS[0], settings),
+        "redraw_dial": redraw_dial,
+        "show_text": lambda: show_text("100", settings, (0, settings["deg2pix"](0.7))),
+    }
+
+
+def measure(function, settings, n_calls):
+    # Warm up, so one-off costs (e.g. building pooled stimuli) aren't counted
+    function()
+
+    times = np.empty(n_calls)
+    for i in range(n_calls):
+        start = perf_counter()
+        function()
+        times[i] = perf_counter() - start
+
+    # Measure allocations separately, tracemalloc slows everything down
+    tracemalloc.start()
+    peaks = np.empty(min(n_calls, 100))
+    for i in range(len(peaks)):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        function()
+        peaks[i] = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    # Don't let the back buffer fill up with test frames
+    settings["window"].clearBuffer()
+
+    return {
+        "median_in_ms": round(float(np.median(times)) * 1000, 4),
+        "p99_in_ms": round(float(np.percentile(times, 99)) * 1000, 4),
+        "allocated_bytes": int(np.median(peaks)),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print every result next to its baseline and return the names that got slower."""
+    slower = []
+
+    for name, result in results.items():
+        previous = baseline.get(name)
+        is_slower = previous is not None and result["median_in_ms"] > previous[
+            "median_in_ms"
+        ] * (1 + tolerance)
+
+        if is_slower:
+            slower.append(name)
+
+        print(
+            f"{name:<22} {result['median_in_ms']:>8.4f} ms "
+            f"(p99 {result['p99_in_ms']:.4f} ms, {result['allocated_bytes']} bytes, "
+            + (
+                f"baseline {previous['median_in_ms']:.4f} ms)"
+                if previous
+                else "no baseline)"
+            )
+            + ("  SLOWER" if is_slower else "")
+        )
+
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--headless", action="store_true")
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--save", action="store_true")
+    args = parser.parse_args()
+
+    monitor, directory = get_monitor_and_dir(False)
+    settings = get_settings(monitor, directory, args.headless)
+    backend = "headless" if args.headless else "window"
+
+    results = {
+        name: measure(function, settings, args.calls)
+        for name, function in get_benchmarks(settings).items()
+    }
+    settings["window"].close()
+
+    baselines = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as file:
+            baselines = json.load(file)
+
+    slower = compare(results, baselines.get(backend, {}), args.tolerance)
+
+    if args.save:
+        baselines[backend] = results
+        with open(BASELINE_FILE, "w") as file:
+            json.dump(baselines, file, indent=4)
+        print(f"Saved as new {backend} baseline in {BASELINE_FILE}")
+    elif slower:
+        sys.exit(f"Slower than the baseline allows: {', '.join(slower)}")
+
+
+if __name__ == "__main__":
+    main()
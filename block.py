@@ -9,25 +9,27 @@ made by Anna van Harmelen, 2024
 import random
 from trial import show_text
 from response import wait_for_key
+from fliplog import flip
 
+BLOCK_TYPES = [
+    ("predictable", "early"),
+    ("predictable", "middle"),
+    ("predictable", "late"),
+    ("unpredictable", 0),
+]
 
-def create_blocks(n_blocks):
+
+def create_blocks(n_blocks, rng=random):
     if n_blocks % 6 != 0:
         raise Exception("Expected number of blocks to be divisible by 6.")
 
-    # Generate an equal number of blocks of all types
-    block_types = [
-        ("predictable", "early"),
-        ("predictable", "middle"),
-        ("predictable", "late"),
-        ("unpredictable", 0),
-        ("unpredictable", 0),
-        ("unpredictable", 0),
-    ]
+    # Generate an equal number of blocks of all types,
+    # with as many unpredictable blocks as predictable ones
+    block_types = BLOCK_TYPES[:3] + 3 * BLOCK_TYPES[3:]
 
     blocks = (n_blocks // 6) * block_types
-    
-    random.shuffle(blocks)
+
+    rng.shuffle(blocks)
 
     # Save list of sets of block numbers (in order) + block types
     blocks = list(zip(range(1, n_blocks + 1), blocks))
@@ -35,7 +37,7 @@ def create_blocks(n_blocks):
     return blocks
 
 
-def create_trials_in_block(n_trials, block_type):
+def create_trials_in_block(n_trials, block_type, rng=random):
     if n_trials % 36 != 0:
         raise Exception("Expected number of trials to be divisible by 36.")
 
@@ -70,11 +72,17 @@ def create_trials_in_block(n_trials, block_type):
 
     # Create trial parameters for all trials
     trials = list(zip(locations, congruencies, flicker_types, cue_timings))
-    random.shuffle(trials)
+    rng.shuffle(trials)
 
     return trials
 
 
+def drain_io(settings):
+    # Finish writing everything from the last block while the participant rests
+    if "io_worker" in settings:
+        settings["io_worker"].drain()
+
+
 def block_break(current_block, n_blocks, settings, eyetracker):
     blocks_left = n_blocks - current_block
 
@@ -83,9 +91,10 @@ def block_break(current_block, n_blocks, settings, eyetracker):
         f"have {blocks_left} block{'s' if blocks_left != 1 else ''} left. "
         "Take a break if you want to, but try not to move your head during this break."
         "\nPress SPACE when you're ready to continue.",
-        settings["window"],
+        settings,
     )
-    settings["window"].flip()
+    flip(settings, "break")
+    drain_io(settings)
 
     if eyetracker:
         keys = wait_for_key(["space", "c"], settings["keyboard"])
@@ -104,9 +113,10 @@ def long_break(n_blocks, settings, eyetracker):
         f"You're halfway through! You have {n_blocks // 2} blocks left. "
         "Now is the time to take a longer break. Maybe get up, stretch, walk around."
         "\nPress SPACE whenever you're ready to continue again.",
-        settings["window"],
+        settings,
     )
-    settings["window"].flip()
+    flip(settings, "break")
+    drain_io(settings)
 
     if eyetracker:
         keys = wait_for_key(["space", "c"], settings["keyboard"])
@@ -123,9 +133,9 @@ def finish(n_blocks, settings):
     show_text(
         f"Congratulations! You successfully finished all {n_blocks} blocks!"
         "You're completely done now. Press SPACE to exit the experiment.",
-        settings["window"],
+        settings,
     )
-    settings["window"].flip()
+    flip(settings, "break")
 
     wait_for_key(["space"], settings["keyboard"])
 
@@ -133,8 +143,8 @@ def finish(n_blocks, settings):
 def quick_finish(settings):
     show_text(
         f"You've exited the experiment. Press SPACE to close this window.",
-        settings["window"],
+        settings,
     )
-    settings["window"].flip()
+    flip(settings, "break")
 
     wait_for_key(["space"], settings["keyboard"])
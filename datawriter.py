@@ -0,0 +1,83 @@
+"""
+This file contains the functions necessary for
+saving trial data to disk as soon as a trial is done.
+To run the 'unpredictable flickering null-cue experiment', see main.py.
+
+made by Anna van Harmelen, 2024
+"""
+
+import json
+import os
+import pandas as pd
+
+
+def to_json_value(value):
+    # Save anything that isn't a plain value (lists, tuples) as pandas would in a .csv
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+
+    return str(value)
+
+
+class TrialWriter:
+    """
+    usage:
+
+       writer = TrialWriter(path, flush_every=6)
+       writer.write(trial_data)
+       ...
+       writer.close()
+       rebuild_csv(path, csv_path)
+
+    Every trial is appended to `path` as one line of JSON. Lines are written
+    to disk (and fsync'ed) in batches of `flush_every` trials, or whenever
+    `flush` is called, so a crash loses at most one unflushed batch.
+    """
+
+    def __init__(self, path, flush_every=1) -> None:
+        self.path = path
+        self.flush_every = flush_every
+        self.file = open(path, "a", encoding="utf-8")
+        self.pending = []
+        self.n_written = 0
+
+    def write(self, trial_data: dict):
+        self.pending.append(
+            json.dumps({key: to_json_value(value) for key, value in trial_data.items()})
+        )
+        self.n_written += 1
+
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.file.write("\n".join(self.pending) + "\n")
+            self.pending = []
+
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+def rebuild_csv(log_path, csv_path):
+    """
+    Turn an append log written by TrialWriter into the session's .csv.
+    A last line that was only half written (e.g. during a power cut) is skipped.
+    """
+    rows = []
+
+    with open(log_path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"Skipped incomplete line in {log_path}: {line!r}")
+
+    pd.DataFrame(rows).to_csv(csv_path, index=False)
+
+    return len(rows)
@@ -8,11 +8,14 @@ made by Anna van Harmelen, 2024
 from set_up import get_monitor_and_dir, get_settings
 from practice import practice
 from trial import generate_stimuli_characteristics, single_trial
+from stimuli import time_pool_savings
 
 
 monitor, directory = get_monitor_and_dir(True)
 settings = get_settings(monitor, directory)
 
+print(time_pool_savings(settings))
+
 stimuli_characteristics: dict = generate_stimuli_characteristics(
         "congruent", "left", "high_freq", "middle", "unpredictable"
     )
@@ -0,0 +1,226 @@
+"""
+This script converts an eyetracker recording (.edf, or its .asc export) into
+files that later analyses can open in milliseconds, instead of parsing text again:
+
+    python edfconvert.py 1_23.edf [more .edf/.asc files]
+
+Every recording gets a folder next to it with:
+ - samples.dat: all samples (time, x, y, pupil) as SAMPLE_DTYPE records,
+   described by recording.json and opened as a memory map by `open_recording`
+ - messages.npy, triggers.npy, blinks.npy, saccades.npy, fixations.npy:
+   one table per event type, sorted by (start) time so they can be searched
+
+Converting an .edf needs edf2asc from the EyeLink Developers Kit on the PATH.
+To run the 'unpredictable flickering null-cue experiment', see main.py.
+
+made by Anna van Harmelen, 2024
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import numpy as np
+
+SAMPLE_DTYPE = np.dtype([("time", "f8"), ("x", "f4"), ("y", "f4"), ("pupil", "f4")])
+TRIGGER_DTYPE = np.dtype([("time", "f8"), ("frame", "u1"), ("condition_code", "u1")])
+BLINK_DTYPE = np.dtype([("start", "f8"), ("end", "f8"), ("duration", "f4")])
+SACCADE_DTYPE = np.dtype(
+    [
+        ("start", "f8"),
+        ("end", "f8"),
+        ("duration", "f4"),
+        ("start_x", "f4"),
+        ("start_y", "f4"),
+        ("end_x", "f4"),
+        ("end_y", "f4"),
+        ("amplitude", "f4"),
+        ("peak_velocity", "f4"),
+    ]
+)
+FIXATION_DTYPE = np.dtype(
+    [
+        ("start", "f8"),
+        ("end", "f8"),
+        ("duration", "f4"),
+        ("x", "f4"),
+        ("y", "f4"),
+        ("pupil", "f4"),
+    ]
+)
+
+# Samples are written to disk per chunk, so memory use doesn't grow with the recording
+CHUNK_SIZE = 65536
+
+# Same pattern as decode_triggers in eyetracker.py, e.g. "trig215"
+TRIGGER_PATTERN = re.compile(r"trig(\d)(\d+)$")
+
+
+def to_float(value):
+    # Missing values (e.g. during a blink) are written as "."
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def export_asc(edf_path):
+    """Export an .edf to an .asc next to it, with SR Research's edf2asc."""
+    if shutil.which("edf2asc") is None:
+        raise RuntimeError(
+            "edf2asc not found, install the EyeLink Developers Kit "
+            "or convert the .asc export instead."
+        )
+
+    subprocess.run(["edf2asc", "-y", edf_path], check=True, capture_output=True)
+
+    return os.path.splitext(edf_path)[0] + ".asc"
+
+
+def parse_message(parts):
+    # MSG <time> [<offset>] <text>, the offset says how much earlier it happened
+    time = float(parts[1])
+    offset, _, text = parts[2].partition(" ")
+
+    if text and offset.lstrip("-").isdigit():
+        return time - int(offset), text
+
+    return time, parts[2]
+
+
+def convert_recording(path, output_directory=None):
+    """
+    Stream `path` (.edf or .asc) once and save its samples and events in
+    `output_directory` (by default a folder next to it with the same name).
+    Returns `output_directory`.
+    """
+    if path.lower().endswith(".edf"):
+        path = export_asc(path)
+
+    output_directory = output_directory or os.path.splitext(path)[0]
+    os.makedirs(output_directory, exist_ok=True)
+
+    chunk = np.empty(CHUNK_SIZE, dtype=SAMPLE_DTYPE)
+    n_in_chunk = 0
+    n_samples = 0
+    sample_rate = None
+
+    messages = []
+    triggers = []
+    blinks = []
+    saccades = []
+    fixations = []
+
+    with open(path, encoding="latin-1") as asc, open(
+        os.path.join(output_directory, "samples.dat"), "wb"
+    ) as samples:
+        for line in asc:
+            # Samples are by far the most lines, so check for them first
+            if line[:1].isdigit():
+                parts = line.split()
+                chunk[n_in_chunk] = (
+                    float(parts[0]),
+                    to_float(parts[1]),
+                    to_float(parts[2]),
+                    to_float(parts[3]),
+                )
+                n_in_chunk += 1
+
+                if n_in_chunk == CHUNK_SIZE:
+                    chunk.tofile(samples)
+                    n_samples += n_in_chunk
+                    n_in_chunk = 0
+
+            elif line.startswith("MSG"):
+                time, text = parse_message(line.rstrip("\n").split(None, 2))
+                messages.append((time, text))
+
+                trigger = TRIGGER_PATTERN.search(text)
+                if trigger:
+                    triggers.append((time, int(trigger[1]), int(trigger[2])))
+
+            elif line.startswith("EBLINK"):
+                blinks.append(tuple(to_float(value) for value in line.split()[2:5]))
+
+            elif line.startswith("ESACC"):
+                saccades.append(tuple(to_float(value) for value in line.split()[2:11]))
+
+            elif line.startswith("EFIX"):
+                fixations.append(tuple(to_float(value) for value in line.split()[2:8]))
+
+            elif line.startswith("SAMPLES") and "RATE" in line:
+                parts = line.split()
+                sample_rate = float(parts[parts.index("RATE") + 1])
+
+        chunk[:n_in_chunk].tofile(samples)
+        n_samples += n_in_chunk
+
+    with open(os.path.join(output_directory, "recording.json"), "w") as sidecar:
+        json.dump(
+            {
+                "source": os.path.basename(path),
+                "sample_rate": sample_rate,
+                "n_samples": n_samples,
+                "samples_dtype": SAMPLE_DTYPE.descr,
+            },
+            sidecar,
+            indent=4,
+        )
+
+    text_length = max((len(text) for _, text in messages), default=1)
+    message_dtype = np.dtype([("time", "f8"), ("text", f"U{text_length}")])
+
+    for name, rows, dtype, key in [
+        ("messages", messages, message_dtype, "time"),
+        ("triggers", triggers, TRIGGER_DTYPE, "time"),
+        ("blinks", blinks, BLINK_DTYPE, "start"),
+        ("saccades", saccades, SACCADE_DTYPE, "start"),
+        ("fixations", fixations, FIXATION_DTYPE, "start"),
+    ]:
+        table = np.array(rows, dtype=dtype)
+        # Back-dated messages can end up slightly out of order
+        table = table[np.argsort(table[key], kind="stable")]
+        np.save(os.path.join(output_directory, f"{name}.npy"), table)
+
+    return output_directory
+
+
+def open_recording(directory):
+    """
+    Open a converted recording without reading it: returns a dict with the
+    samples as a read-only memory map, every event table and the sample rate.
+    """
+    with open(os.path.join(directory, "recording.json")) as sidecar:
+        description = json.load(sidecar)
+
+    # An empty file can't be memory mapped
+    samples = np.empty(0, dtype=SAMPLE_DTYPE)
+    if description["n_samples"]:
+        samples = np.memmap(
+            os.path.join(directory, "samples.dat"),
+            dtype=np.dtype([tuple(field) for field in description["samples_dtype"]]),
+            mode="r",
+            shape=(description["n_samples"],),
+        )
+
+    recording = {"sample_rate": description["sample_rate"], "samples": samples}
+
+    for name in ["messages", "triggers", "blinks", "saccades", "fixations"]:
+        recording[name] = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+
+    return recording
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("recordings", nargs="+")
+    args = parser.parse_args()
+
+    for path in args.recordings:
+        print(f"{path} -> {convert_recording(path)}")
+
+
+if __name__ == "__main__":
+    main()
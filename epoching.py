@@ -0,0 +1,140 @@
+"""
+This script cuts the gaze data of converted recordings (see edfconvert.py)
+into epochs around one type of trigger, by default the capture cue onset:
+
+    python epoching.py --session 1_23 data_session_1.csv [--session ...]
+
+Every session is epoched in its own process and saved next to its recording
+as epochs_<frame>.npz, with the epochs (trials x time x channels), the time of
+every sample relative to the trigger (in ms) and the trial number and
+condition code of every epoch.
+To run the 'unpredictable flickering null-cue experiment', see main.py.
+
+made by Anna van Harmelen, 2024
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from edfconvert import open_recording
+
+CHANNELS = ["x", "y", "pupil"]
+
+# Frame codes as sent by eyetracker.py, e.g. 2 for capture_cue_onset
+CAPTURE_CUE_ONSET = 2
+
+EPOCH_WINDOW = (-500, 1500)  # in ms around the trigger
+
+
+def cut_epochs(samples, trigger_times, window, sample_rate):
+    """
+    Return the `samples` from `window[0]` up to `window[1]` ms around every
+    trigger time as one (triggers x time x channels) array, plus the time of
+    every sample relative to the trigger. Samples that weren't recorded
+    (e.g. the recording was paused) are NaN.
+    """
+    relative_times = np.arange(window[0], window[1], 1000 / sample_rate)
+    wanted_times = trigger_times[:, np.newaxis] + relative_times
+
+    # Find the sample closest to every wanted time, all in one go
+    sample_times = np.asarray(samples["time"])
+    indices = np.searchsorted(sample_times, wanted_times).clip(0, len(sample_times) - 1)
+    previous = (indices - 1).clip(0)
+    indices = np.where(
+        np.abs(sample_times[previous] - wanted_times)
+        < np.abs(sample_times[indices] - wanted_times),
+        previous,
+        indices,
+    )
+    recorded = np.abs(sample_times[indices] - wanted_times) < 500 / sample_rate
+
+    epochs = np.stack(
+        [np.asarray(samples[channel])[indices] for channel in CHANNELS], axis=-1
+    ).astype("f4")
+    epochs[~recorded] = np.nan
+
+    return epochs, relative_times
+
+
+def epoch_session(
+    recording_directory, behaviour_path, frame=CAPTURE_CUE_ONSET, window=EPOCH_WINDOW
+):
+    """
+    Epoch one session around every trigger of `frame` and join in the trial
+    number and condition code of that trial from the behavioural .csv.
+    Trials and triggers are matched in order, so the condition codes must agree.
+    """
+    recording = open_recording(recording_directory)
+    behaviour = pd.read_csv(behaviour_path)
+
+    triggers = recording["triggers"][recording["triggers"]["frame"] == frame]
+
+    # A session that was stopped early has a trigger for a trial that wasn't saved
+    n_trials = min(len(triggers), len(behaviour))
+    triggers = triggers[:n_trials]
+    behaviour = behaviour.iloc[:n_trials]
+
+    mismatches = np.flatnonzero(
+        triggers["condition_code"] != behaviour["condition_code"].to_numpy()
+    )
+    if len(mismatches):
+        raise ValueError(
+            f"Triggers and trials of {recording_directory} don't match, "
+            f"first at trial {behaviour['trial_number'].iloc[mismatches[0]]}"
+        )
+
+    epochs, times = cut_epochs(
+        recording["samples"], triggers["time"], window, recording["sample_rate"]
+    )
+
+    return {
+        "epochs": epochs,
+        "times": times,
+        "channels": np.array(CHANNELS),
+        "trial_number": behaviour["trial_number"].to_numpy(),
+        "condition_code": behaviour["condition_code"].to_numpy(),
+    }
+
+
+def epoch_and_save(recording_directory, behaviour_path, frame, window):
+    path = os.path.join(recording_directory, f"epochs_{frame}.npz")
+    np.savez(path, **epoch_session(recording_directory, behaviour_path, frame, window))
+
+    return path
+
+
+def epoch_sessions(
+    sessions, frame=CAPTURE_CUE_ONSET, window=EPOCH_WINDOW, max_workers=None
+):
+    """Epoch and save every (recording_directory, behaviour_path) in `sessions` in parallel."""
+    with ProcessPoolExecutor(max_workers) as executor:
+        futures = [
+            executor.submit(epoch_and_save, directory, behaviour_path, frame, window)
+            for directory, behaviour_path in sessions
+        ]
+
+        return [future.result() for future in futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--session",
+        nargs=2,
+        action="append",
+        required=True,
+        metavar=("RECORDING_DIRECTORY", "BEHAVIOUR_CSV"),
+    )
+    parser.add_argument("--frame", type=int, default=CAPTURE_CUE_ONSET)
+    parser.add_argument("--window", type=float, nargs=2, default=EPOCH_WINDOW)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    for path in epoch_sessions(args.session, args.frame, args.window, args.workers):
+        print(f"Saved {path}")
+
+
+if __name__ == "__main__":
+    main()
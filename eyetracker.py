@@ -6,9 +6,11 @@ To run the 'unpredictable flickering null-cue experiment', see main.py.
 made by Anna van Harmelen, 2023, using code by Rose Nasrawi
 """
 
-from lib import eyelinker
-from psychopy import event
+from itertools import product
 import os
+import queue
+import threading
+import pandas as pd
 
 
 class Eyelinker:
@@ -21,52 +23,207 @@ class Eyelinker:
 
        eyelinker = Eyelinker(participant, session, window, directory)
        eyelinker.calibrate()
+
+    To mark an event, right after the flip that showed it:
+
+       eyelinker.send_trigger(trigger, flip_time)
     """
 
     def __init__(self, participant, session, window, directory) -> None:
         """
         This also connects to the tracker
         """
+        # Only needed with a tracker, so headless sessions run without pylink or psychopy
+        from lib import eyelinker
+
         self.directory = directory
         self.window = window
+        self.session = session
         self.tracker = eyelinker.EyeLinker(
             window=window, eye="RIGHT", filename=f"{session}_{participant}.edf"
         )
         self.tracker.init_tracker()
+        self.dispatcher = TriggerDispatcher(self.tracker)
 
     def start(self):
         self.tracker.start_recording()
 
+        # Keep every sample available to the experiment, e.g. for fixation checks
+        self.tracker.start_buffering()
+        self.dispatcher.sync_clocks()
+
     def calibrate(self):
+        self.tracker.stop_buffering()
         self.tracker.calibrate()
 
+    def send_trigger(self, trigger, flip_time=None):
+        self.dispatcher.dispatch(trigger, flip_time)
+
     def stop(self):
         os.chdir(self.directory)
 
-        self.tracker.stop_recording()
-        self.tracker.transfer_edf()
-        self.tracker.close_edf()
+        # Save the recording first, also if any trigger failed
+        try:
+            self.dispatcher.close()
+        finally:
+            self.dispatcher.save(f"triggers_session_{self.session}.csv")
+
+            self.tracker.stop_buffering()
+            self.tracker.stop_recording()
+            self.tracker.transfer_edf()
+            self.tracker.close_edf()
+
+
+class TriggerDispatcher:
+    """
+    Sends trigger messages to the eyetracker from a background thread,
+    so the link round-trip never delays a flip.
+
+    Every message is prefixed with the number of ms between the flip it marks
+    and the moment it is actually sent. The tracker back-dates the message by
+    that offset, so its time in the .edf matches the real onset.
+    After `sync_clocks`, every trigger also marks the tracker time of its flip
+    in the tracker's saccade buffer.
+    A trigger that fails doesn't stop the others, `close` raises the first error.
+    """
+
+    def __init__(self, tracker) -> None:
+        from psychopy import core
+
+        # The clock of the flips, so triggers can be back-dated to them
+        self.get_time = core.getTime
+        self.tracker = tracker
+        self.clock_offset = None
+        self.queue = queue.SimpleQueue()
+        self.log = []
+        self.errors = []
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def dispatch(self, trigger, flip_time=None):
+        # Without a flip, the trigger marks the moment it was dispatched
+        self.queue.put((trigger, self.get_time() if flip_time is None else flip_time))
+
+    def sync_clocks(self, n_tries=10):
+        """
+        Estimate the tracker time minus core.getTime() (in ms), from the reading
+        with the shortest round-trip over the link, so triggers can be converted to
+        tracker time without asking the tracker.
+        """
+        if self.tracker.mock:
+            return
+
+        round_trip, offset = min(
+            (after - before, tracker_time - (before + after) / 2 * 1000)
+            for before, tracker_time, after in (
+                (self.get_time(), self.tracker.tracker_time(), self.get_time())
+                for _ in range(n_tries)
+            )
+        )
+        self.clock_offset = offset
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+        if self.errors:
+            print(f"{len(self.errors)} trigger(s) failed: {self.errors}")
+            raise self.errors[0]
+
+    def save(self, path):
+        pd.DataFrame(
+            self.log,
+            columns=["trigger", "flip_time", "offset_in_ms", "dispatch_time_in_ms"],
+        ).to_csv(path, index=False)
+
+    def _run(self):
+        while (task := self.queue.get()) is not None:
+            trigger, flip_time = task
+
+            try:
+                self._send(trigger, flip_time)
+            except Exception as e:
+                self.errors.append(e)
+
+    def _send(self, trigger, flip_time):
+        start = self.get_time()
+        offset = round((start - flip_time) * 1000)
+        self.tracker.send_message(f"{offset} trig{trigger}")
+
+        # So online checks can ask for e.g. saccades since this trigger
+        if self.clock_offset is not None:
+            self.tracker.saccades.mark(trigger, flip_time * 1000 + self.clock_offset)
+
+        self.log.append(
+            (trigger, flip_time, offset, round((self.get_time() - start) * 1000, 3))
+        )
+
+
+FRAME_CODES = {
+    "just_code_please": "",
+    "stimuli_onset": "1",
+    "capture_cue_onset": "2",
+    "probe_cue_onset": "3",
+    "response_onset": "4",
+    "response_offset": "5",
+    "feedback_onset": "6",
+}
+
+# Every condition gets its own number from 1 to 72 by adding up these markers
+CONDITION_MARKERS = {
+    "predictability": {"predictable": 1, "unpredictable": 37},
+    "cue_timing": {"early": 0, "middle": 12, "late": 24},
+    "trial_condition": {"congruent": 0, "incongruent": 6},
+    "flicker_type": {"stable": 0, "high_freq": 2, "low_freq": 4},
+    "target_bar": {"left": 0, "right": 1},
+}
+
+# Compile all condition numbers once, so getting a trigger is a single lookup
+CONDITIONS = {
+    conditions: sum(
+        markers[condition]
+        for markers, condition in zip(CONDITION_MARKERS.values(), conditions)
+    )
+    for conditions in product(*CONDITION_MARKERS.values())
+}
+
+TRIGGER_CODES = {
+    (frame, *conditions): frame_code + str(condition_marker)
+    for frame, frame_code in FRAME_CODES.items()
+    for conditions, condition_marker in CONDITIONS.items()
+}
+
+# Column per condition with the condition of every condition number (as index)
+CONDITION_TABLE = pd.DataFrame(
+    list(CONDITIONS.keys()),
+    columns=list(CONDITION_MARKERS.keys()),
+    index=list(CONDITIONS.values()),
+).reindex(range(max(CONDITIONS.values()) + 1))
+
+FRAME_TABLE = pd.Series(
+    list(FRAME_CODES.keys())[1:], index=list(FRAME_CODES.values())[1:]
+)
 
 
 def get_trigger(frame, predictability, timing, congruency, flicker_type, location):
-    condition_marker = {"predictable": 1, "unpredictable": 37}[predictability]
-    
-    condition_marker += {"early": 0, "middle": 12, "late": 24}[timing]
-
-    if congruency == "incongruent":
-        condition_marker += 6
-
-    condition_marker += {"stable": 0, "high_freq": 2, "low_freq": 4}[flicker_type]
-
-    if location == "right":
-        condition_marker += 1
-
-    return {
-        "just_code_please": "",
-        "stimuli_onset": "1",
-        "capture_cue_onset": "2",
-        "probe_cue_onset": "3",
-        "response_onset": "4",
-        "response_offset": "5",
-        "feedback_onset": "6",
-    }[frame] + str(condition_marker)
+    return TRIGGER_CODES[
+        (frame, predictability, timing, congruency, flicker_type, location)
+    ]
+
+
+def decode_triggers(messages: pd.Series):
+    """
+    Turn a column of trigger messages (e.g. "trig215", optionally with an offset
+    before it) or bare condition codes (e.g. 15) back into their conditions.
+    Returns one row per message with the frame, condition code and conditions,
+    messages that aren't triggers get empty values.
+    """
+    codes = messages.astype(str).str.extract(r"^(?:.*trig(\d))?(\d+)$")
+    condition_codes = pd.to_numeric(codes[1])
+
+    decoded = CONDITION_TABLE.reindex(condition_codes.fillna(-1).astype(int))
+    decoded.index = messages.index
+    decoded.insert(0, "condition_code", condition_codes)
+    decoded.insert(0, "frame", FRAME_TABLE.reindex(codes[0]).to_numpy())
+
+    return decoded
@@ -0,0 +1,89 @@
+"""
+This file contains the functions necessary for
+checking online whether the participant keeps fixating during a trial.
+To run the 'unpredictable flickering null-cue experiment', see main.py.
+
+made by Anna van Harmelen, 2024
+"""
+
+import numpy as np
+
+FIXATION_RADIUS = 2  # in degrees from the centre, the bars are at 6
+MIN_BREAK_DURATION = 20  # in ms outside the radius, so noise isn't a break
+
+# Fixation is checked from the onset of the first of these screens
+# up to the onset of the screen after the last one
+MONITORED_SCREENS = ["stimuli_onset", "cue_delay"]
+
+
+class FixationMonitor:
+    """
+    usage:
+
+       eyelinker.start()  # also starts buffering samples
+       settings["fixation_monitor"] = FixationMonitor(eyelinker.tracker, settings)
+
+    Then, during a trial:
+
+       fixation_monitor.start()  # right after the first monitored flip
+       fixation_monitor.check()  # every frame, True once fixation is broken
+       fixation_monitor.stop()  # right after the last monitored flip
+
+    Every check only reads the samples that came in since the previous one from
+    the tracker's sample buffer (see lib/eyelinker.py) and tests them all at once.
+    Samples without gaze (e.g. during a blink) don't count as a break.
+    """
+
+    def __init__(self, tracker, settings, eye="right", radius=FIXATION_RADIUS) -> None:
+        # The tracker gets a new buffer whenever it starts buffering again
+        self.tracker = tracker
+        self.centre = np.array(settings["monitor"]["resolution"]) / 2
+        self.radius = settings["deg2pix"](radius)
+        self.eye = eye
+        self.active = False
+        self.broken = False
+        self.next_time = -np.inf
+        self.last_inside = -np.inf
+
+    def start(self):
+        newest = self.tracker.samples.read(1)
+        now = newest["time"][0] if len(newest) else -np.inf
+
+        self.active = True
+        self.broken = False
+        self.next_time = np.nextafter(now, np.inf)
+        self.last_inside = now
+
+    def stop(self):
+        broken = self.check()
+        self.active = False
+
+        return broken
+
+    def check(self):
+        if not self.active:
+            return self.broken
+
+        samples = self.tracker.samples.get_since(self.next_time)
+        if not len(samples):
+            return self.broken
+
+        times = samples["time"]
+        outside = (
+            np.hypot(
+                samples[f"{self.eye}_x"] - self.centre[0],
+                samples[f"{self.eye}_y"] - self.centre[1],
+            )
+            > self.radius
+        )
+
+        # Time of the last sample inside the radius, as of every sample
+        last_inside = np.maximum.accumulate(np.where(outside, self.last_inside, times))
+
+        self.broken |= bool(
+            np.any(outside & (times - last_inside >= MIN_BREAK_DURATION))
+        )
+        self.next_time = np.nextafter(times[-1], np.inf)
+        self.last_inside = last_inside[-1]
+
+        return self.broken
@@ -0,0 +1,50 @@
+"""
+This file contains the functions necessary for
+precomputing the frame-by-frame flicker of the capture cue.
+Flickering cues alternate between the cue colour and grey, stable cues never
+alternate: they stay in the cue colour for the whole cue duration, also on the
+last frame (the original timing loop turned them grey for the last tenth).
+To run the 'unpredictable flickering null-cue experiment', see main.py.
+
+made by Anna van Harmelen, 2024
+"""
+
+from functools import lru_cache
+import numpy as np
+
+# Flicker frequencies in Hz (one full cycle is cue colour + grey), stable never switches
+FLICKER_FREQUENCIES = {"stable": None, "high_freq": 6, "low_freq": 3}
+
+
+@lru_cache(maxsize=None)
+def get_flicker_schedule(flicker_type, n_frames, refresh_rate):
+    """
+    Return the fill colour index (0 = cue colour, 1 = grey) of every frame of the cue.
+    Each switch happens on the first frame that starts at or after its exact moment, so
+    half-periods that don't fit a whole number of frames alternate between
+    the two nearest frame counts and the frequency doesn't drift.
+    """
+    frequency = FLICKER_FREQUENCIES[flicker_type]
+
+    if frequency is None:
+        schedule = np.zeros(n_frames, dtype=np.uint8)
+    else:
+        half_periods = np.floor(np.arange(n_frames) * 2 * frequency / refresh_rate)
+        schedule = (half_periods % 2).astype(np.uint8)
+
+    schedule.flags.writeable = False
+
+    return schedule
+
+
+def get_realized_frequency(schedule, flip_times):
+    """
+    Return the frequency (Hz) at which the cue actually switched colour, from the
+    recorded `flip_times` of every frame of the cue, so late or dropped frames count.
+    """
+    switch_times = np.asarray(flip_times)[np.flatnonzero(np.diff(schedule)) + 1]
+
+    if len(switch_times) < 2:
+        return 0.0
+
+    return round(1 / (2 * float(np.mean(np.diff(switch_times)))), 3)
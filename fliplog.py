@@ -0,0 +1,135 @@
+"""
+This file contains the functions necessary for
+recording the timestamp of every screen flip during the experiment.
+To run the 'unpredictable flickering null-cue experiment', see main.py.
+
+made by Anna van Harmelen, 2024
+"""
+
+import numpy as np
+
+# What was on screen after a flip, stored as index into this list
+FLIP_LABELS = [
+    "iti",
+    "stimuli_onset",
+    "cue_delay",
+    "capture_cue_onset",
+    "probe_delay",
+    "probe_cue_onset",
+    "response",
+    "feedback",
+    "break",
+]
+
+# After these flips the experiment deliberately waits (for a key or a sleep),
+# so the interval to the next flip doesn't say anything about dropped frames
+WAITING_LABELS = [
+    FLIP_LABELS.index(label) for label in ["probe_cue_onset", "feedback", "break"]
+]
+
+FLIP_DTYPE = np.dtype([("trial", "u2"), ("label", "u1"), ("time", "f8")])
+
+
+def flip(settings, label):
+    """Flip the window and record when that happened, if a flip log is set up."""
+    flip_time = settings["window"].flip()
+
+    if "flip_log" in settings:
+        settings["flip_log"].record(label, flip_time)
+
+    return flip_time
+
+
+def append_flips(path, flips):
+    with open(path, "ab") as file:
+        flips.tofile(file)
+
+
+class FlipLog:
+    """
+    usage:
+
+       flip_log = FlipLog(path, refresh_rate)
+       settings["flip_log"] = flip_log
+
+    Then, for every trial:
+
+       flip_log.start_trial(trial_number)
+       ... flip(settings, label) ...
+       flip_log.summarise(expected_cue_onset)
+
+    All flips are appended to `path` as FLIP_DTYPE records, read them back with
+    `np.fromfile(path, dtype=FLIP_DTYPE)`. Pass an IOWorker to do that writing
+    on a background thread.
+    """
+
+    def __init__(self, path, refresh_rate, io_worker=None, capacity=4096) -> None:
+        self.path = path
+        self.refresh_rate = refresh_rate
+        self.io_worker = io_worker
+        self.flips = np.zeros(capacity, dtype=FLIP_DTYPE)
+        self.n_flips = 0
+        self.trial = 0
+
+    def start_trial(self, trial_number):
+        # Flips after the previous trial (e.g. breaks) still belong to that trial
+        self.save()
+        self.trial = trial_number
+
+    def record(self, label, flip_time):
+        if self.n_flips == len(self.flips):
+            self.flips = np.resize(self.flips, 2 * len(self.flips))
+
+        self.flips[self.n_flips] = (self.trial, FLIP_LABELS.index(label), flip_time)
+        self.n_flips += 1
+
+    def save(self):
+        if self.n_flips:
+            # Copy, because the buffer is reused for the next trial straight away
+            flips = self.flips[: self.n_flips].copy()
+
+            if self.io_worker:
+                self.io_worker.submit(append_flips, self.path, flips)
+            else:
+                append_flips(self.path, flips)
+
+        self.n_flips = 0
+
+    def get_flip_times(self, label):
+        """Return the times of all flips of the current trial that showed `label`."""
+        flips = self.flips[: self.n_flips]
+
+        return flips["time"][flips["label"] == FLIP_LABELS.index(label)]
+
+    def summarise(self, expected_cue_onset):
+        """
+        Summarise the flips of the current trial. `expected_cue_onset` is the
+        planned time between stimuli onset and capture cue onset in seconds, in
+        whole frames (see timeline.get_planned_time), so a perfect trial has no error.
+        """
+        flips = self.flips[: self.n_flips]
+
+        intervals = np.diff(flips["time"])
+        intervals = intervals[~np.isin(flips["label"][:-1], WAITING_LABELS)]
+        frames_per_interval = np.round(intervals * self.refresh_rate)
+
+        onsets = {
+            label: flips["time"][np.argmax(flips["label"] == FLIP_LABELS.index(label))]
+            for label in ["stimuli_onset", "capture_cue_onset"]
+        }
+
+        return {
+            "max_inter_flip_interval_in_ms": (
+                round(float(intervals.max()) * 1000, 2) if len(intervals) else None
+            ),
+            "dropped_frames": int(np.clip(frames_per_interval - 1, 0, None).sum()),
+            "cue_onset_error_in_ms": round(
+                float(
+                    onsets["capture_cue_onset"]
+                    - onsets["stimuli_onset"]
+                    - expected_cue_onset
+                )
+                * 1000,
+                2,
+            ),
+        }
@@ -0,0 +1,80 @@
+"""
+This file contains the functions necessary for
+writing data to disk on a background thread, away from the flips.
+To run the 'unpredictable flickering null-cue experiment', see main.py.
+
+made by Anna van Harmelen, 2024
+"""
+
+import queue
+import threading
+
+
+class IOWorker:
+    """
+    usage:
+
+       io_worker = IOWorker()
+       io_worker.submit(writer.write, trial_data)
+
+    Submitted calls are run in order on one background thread. If more than
+    `max_queue` calls are waiting, `submit` blocks until there is room again
+    (and counts a stall), so a slow disk can't eat all memory.
+    Call `drain` during breaks, which prints the calls that failed since the last
+    drain, and `close` at shutdown, which raises the first call that failed at all.
+    """
+
+    def __init__(self, max_queue=64) -> None:
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stalls = 0
+        self.max_depth = 0
+        self.errors = []
+        self.n_reported_errors = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    def submit(self, function, *args, **kwargs):
+        try:
+            self.queue.put_nowait((function, args, kwargs))
+        except queue.Full:
+            self.stalls += 1
+            self.queue.put((function, args, kwargs))
+
+        self.max_depth = max(self.max_depth, self.depth)
+
+    def drain(self):
+        """Wait until everything submitted so far has been written."""
+        self.queue.join()
+
+        # Keep the session going, the errors are raised again by `close`
+        new_errors = self.errors[self.n_reported_errors :]
+        if new_errors:
+            print(f"{len(new_errors)} background write(s) failed: {new_errors}")
+            self.n_reported_errors = len(self.errors)
+
+    def close(self):
+        self.drain()
+        self.queue.put(None)
+        self.thread.join()
+
+        if self.errors:
+            raise self.errors[0]
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+
+            try:
+                if task is None:
+                    return
+
+                function, args, kwargs = task
+                function(*args, **kwargs)
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                self.queue.task_done()
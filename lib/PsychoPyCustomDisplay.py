@@ -10,11 +10,12 @@ PsychoPyCustomDisplay -- inherited from pylink.EyeLinkCustomDisplay. Defines how
  should be handled by psychopy.
 """
 
-import array
 import string
+import time
 import warnings
 
-import PIL
+import numpy as np
+import PIL.Image
 
 import pylink
 
@@ -57,8 +58,16 @@ class PsychoPyCustomDisplay(pylink.EyeLinkCustomDisplay):
         self.window_adj = [i / 2 for i in self.window.size]
         self.tracker = tracker
 
-        self.pal = []
-        self.image_buffer = array.array('I')
+        # Palette index to RGB lookup table, and the camera image it's applied to line by line
+        self.palette = np.zeros((1, 3), dtype=np.uint8)
+        self.frame = np.zeros((0, 0, 3), dtype=np.uint8)
+        self.image_stim = None
+        self.upload_times = []
+
+        # Crosshair lines and lozenges, reused every camera frame (see _get_overlay_stim)
+        self.overlay_stims = {'line': [], 'lozenge': []}
+        self.n_overlay_stims_used = {'line': 0, 'lozenge': 0}
+        self.overlay_times = []
         
         if all(i >= 0.5 for i in self.window.color):
             self.text_color = (-1, -1, -1)
@@ -139,6 +148,9 @@ class PsychoPyCustomDisplay(pylink.EyeLinkCustomDisplay):
     def setup_image_display(self, width, height):
         """Shows mouse when camera images are visible."""
         psychopy.event.Mouse(visible=True)
+        self.frame = np.zeros((height, width, 3), dtype=np.uint8)
+        self.upload_times = []
+        self.overlay_times = []
         self.window.flip()
 
     def image_title(self, title):
@@ -147,38 +159,50 @@ class PsychoPyCustomDisplay(pylink.EyeLinkCustomDisplay):
 
     def draw_image_line(self, width, line, totlines, buff):
         """Draws image from buffer."""
-        for i in buff:
-            if i >= len(self.pal):
-                self.image_buffer.append(self.pal[-1])
-            else:
-                self.image_buffer.append(self.pal[i])
+        if self.frame.shape[:2] != (totlines, width):
+            self.frame = np.zeros((totlines, width, 3), dtype=np.uint8)
+
+        # Colours past the end of the palette get its last colour
+        self.frame[line - 1, :len(buff)] = self.palette.take(buff, axis=0, mode='clip')
 
         if line == totlines:
-            bufferv = self.image_buffer.tostring()
-            image = PIL.Image.frombytes("RGBX", (width, totlines), bufferv)
+            # Upload the whole image into the same texture every time
+            start = time.perf_counter()
+            image = PIL.Image.fromarray(self.frame)
+            if self.image_stim is None:
+                self.image_stim = psychopy.visual.ImageStim(
+                    self.window, image=image, units='pix', size=(width, totlines))
+            else:
+                self.image_stim.image = image
+                self.image_stim.size = (width, totlines)
+            self.upload_times.append(time.perf_counter() - start)
 
-            psychopy_image = psychopy.visual.ImageStim(self.window, image=image)
+            self.image_stim.draw()
 
-            psychopy_image.draw()
+            start = time.perf_counter()
             self.draw_cross_hair()
+            self.overlay_times.append(time.perf_counter() - start)
+
             self.image_title_object.draw()
             self.window.flip()
 
-            self.image_buffer = array.array('I')
+            # Next frame, all overlay stims can be used again
+            self.n_overlay_stims_used = {'line': 0, 'lozenge': 0}
 
     def set_image_palette(self, r, g, b):
         """Defines image colors."""
-        self.pal = []
-
-        # Code taken from pylink docs and altered
-        for r_, g_, b_ in zip(r, g, b):
-            self.pal.append((b_ << 16) | g_ << 8 | r_)
+        self.palette = np.stack([r, g, b], axis=-1).astype(np.uint8)
 
     def exit_image_display(self):
         """Hides mouse when camera images are no longer visible."""
         psychopy.event.Mouse(visible=False)
         self.window.flip()
 
+        if self.upload_times:
+            print('Camera image: %d frames, median upload %.2f ms, median overlay %.2f ms' % (
+                len(self.upload_times), np.median(self.upload_times) * 1000,
+                np.median(self.overlay_times) * 1000))
+
     def clear_cal_display(self):
         """Clears calibration targets."""
         self.window.flip()
@@ -239,9 +263,11 @@ class PsychoPyCustomDisplay(pylink.EyeLinkCustomDisplay):
         x1, x2 = x1 - 96, x2 - 96
         y1, y2 = (160 - y1 - 80), (160 - y2 - 80)
 
-        psychopy.visual.Line(
-            self.window, units='pix', lineColor=color, start=(x1, y1), end=(x2, y2)
-        ).draw()
+        line = self._get_overlay_stim('line')
+        line.start = (x1, y1)
+        line.end = (x2, y2)
+        line.lineColor = color
+        line.draw()
 
     def draw_lozenge(self, x, y, width, height, colorindex):
         """Draws ovals on image."""
@@ -254,8 +280,26 @@ class PsychoPyCustomDisplay(pylink.EyeLinkCustomDisplay):
         x = round(x + (0.5 * width)) - 96
         y = round((160 - y) - (0.5 * height)) - 80
 
-        psychopy.visual.Circle(
-            self.window, units='pix', lineColor=color, pos=(x, y), size=(width, height)).draw()
+        lozenge = self._get_overlay_stim('lozenge')
+        lozenge.pos = (x, y)
+        lozenge.size = (width, height)
+        lozenge.lineColor = color
+        lozenge.draw()
+
+    def _get_overlay_stim(self, kind):
+        """Returns a line or lozenge that isn't drawn yet this frame, only building a new one
+        if all of them already are."""
+        stims = self.overlay_stims[kind]
+        n_used = self.n_overlay_stims_used[kind]
+
+        if n_used == len(stims):
+            if kind == 'line':
+                stims.append(psychopy.visual.Line(self.window, units='pix'))
+            else:
+                stims.append(psychopy.visual.Circle(self.window, units='pix', fillColor=None))
+
+        self.n_overlay_stims_used[kind] += 1
+        return stims[n_used]
 
     def get_mouse_state(self):
         """Gets mouse position."""
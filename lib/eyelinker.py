@@ -7,6 +7,8 @@ Rewrite by Baiwei Liu (lbwair@icloud.com)
 import os
 import sys
 import time
+import threading
+import numpy as np
 import pygame
 from pygame.locals import *
 
@@ -21,6 +23,11 @@ RIGHT_EYE = 1
 LEFT_EYE  = 0
 BINOCULAR = 2
 
+# One row per sample, eyes that aren't tracked (or lost, e.g. during a blink) are NaN
+SAMPLE_DTYPE = np.dtype([('time', 'f8'),
+                         ('left_x', 'f4'), ('left_y', 'f4'), ('left_pupil', 'f4'),
+                         ('right_x', 'f4'), ('right_y', 'f4'), ('right_pupil', 'f4')])
+
 def _try_connection():
     """Attempts to connect to eyetracker.
     Returns a bool indicating if a connection was made and an exception if applicable.
@@ -93,6 +100,184 @@ def EyeLinker(window, filename, eye, text_color=None):
         print('Continuing with mock eyetracking. Eyetracking data will not be saved!')
         return MockEyeLinker(window, filename, eye, text_color=None)
 
+class SampleBuffer:
+    """A fixed-size ring buffer of gaze samples, written by one thread and read by any other.
+    Reading never locks: a sample is only counted in `n_written` once it's written, and readers
+    drop the oldest samples of their copy if the writer could have overwritten them meanwhile.
+    Parameters:
+    capacity -- the number of samples kept, at 1000 Hz the default keeps the last 16 seconds
+    """
+    def __init__(self, capacity=16384):
+        self.samples = np.full(capacity, np.nan, dtype=SAMPLE_DTYPE)
+        self.capacity = capacity
+        self.n_written = 0
+
+    def write(self, sample):
+        """Adds one sample, a tuple with a value for every field of SAMPLE_DTYPE."""
+        self.samples[self.n_written % self.capacity] = sample
+        self.n_written += 1
+
+    def read(self, n_samples):
+        """Returns a copy of (at most) the newest `n_samples` samples, oldest first."""
+        n_written = self.n_written
+        n_samples = min(n_samples, n_written, self.capacity)
+        samples = self.samples[np.arange(n_written - n_samples, n_written) % self.capacity]
+
+        # The writer may have been busy with one more sample than it counted since
+        n_overwritten = n_samples + (self.n_written - n_written) + 1 - self.capacity
+        return samples[max(n_overwritten, 0):]
+
+    def get_since(self, start_time):
+        """Returns all samples from tracker time `start_time` (in ms) on."""
+        n_samples = 64
+        while True:
+            samples = self.read(n_samples)
+            if len(samples) < n_samples or samples['time'][0] < start_time:
+                return samples[samples['time'] >= start_time]
+            n_samples *= 2
+
+    def get_last(self, ms):
+        """Returns the samples of the last `ms` milliseconds before the newest sample."""
+        newest = self.read(1)
+        if not len(newest):
+            return newest
+        return self.get_since(newest['time'][0] - ms)
+
+
+# One row per saccade, as reported by the tracker at its end
+SACCADE_DTYPE = np.dtype([('start', 'f8'), ('end', 'f8'), ('eye', 'i1'),
+                          ('start_x', 'f4'), ('start_y', 'f4'), ('end_x', 'f4'), ('end_y', 'f4'),
+                          ('ppd_x', 'f4'), ('ppd_y', 'f4')])
+
+
+def get_amplitude_and_direction(saccades):
+    """Returns the amplitude (in degrees) and direction (in degrees, 0 is rightwards and 90
+    upwards) of every saccade in a SACCADE_DTYPE array, all at once."""
+    dx = saccades['end_x'] - saccades['start_x']
+    dy = saccades['end_y'] - saccades['start_y']
+    amplitude = np.hypot(dx / saccades['ppd_x'], dy / saccades['ppd_y'])
+    direction = np.degrees(np.arctan2(-dy, dx))
+    return amplitude, direction
+
+
+class SaccadeBuffer:
+    """Keeps every saccade of the recording in a growing SACCADE_DTYPE array.
+    Fed by the link reader thread (see ConnectedEyeLinker.start_buffering), or call `poll` to drain
+     all waiting link data at once. Like SampleBuffer, it's written by one thread and can be read
+     by any other without locking.
+    Use `mark` to name a moment in tracker time (e.g. a trigger), and `get_saccades` to ask for e.g.
+     all saccades over 1 degree since that moment. Functions added with `on_saccade` are called for
+     every new saccade over their minimum amplitude, on the thread that adds the saccade.
+    """
+    def __init__(self, capacity=1024):
+        self.saccades = np.zeros(capacity, dtype=SACCADE_DTYPE)
+        self.n_saccades = 0
+        self.marks = {}
+        self.callbacks = []
+
+    def add(self, event):
+        """Adds a pylink end of saccade event."""
+        if self.n_saccades == len(self.saccades):
+            # Readers still have the old array, which is valid up to the count they read
+            self.saccades = np.concatenate([self.saccades, np.zeros_like(self.saccades)])
+
+        start_ppd, end_ppd = event.getStartPPD(), event.getEndPPD()
+        self.saccades[self.n_saccades] = (
+            event.getStartTime(), event.getEndTime(), event.getEye(),
+            *event.getStartGaze(), *event.getEndGaze(),
+            (start_ppd[0] + end_ppd[0]) / 2, (start_ppd[1] + end_ppd[1]) / 2)
+        self.n_saccades += 1
+
+        if self.callbacks:
+            saccade = self.saccades[self.n_saccades - 1:self.n_saccades]
+            amplitude, direction = get_amplitude_and_direction(saccade)
+            for min_amplitude, function in self.callbacks:
+                if amplitude[0] >= min_amplitude:
+                    function(saccade[0], amplitude[0], direction[0])
+
+    def poll(self, tracker):
+        """Drains all waiting data from the link of a pylink tracker, keeping the saccades.
+        Only use this if nothing else reads the link (e.g. the reader thread)."""
+        while True:
+            data_type = tracker.getNextData()
+            if not data_type:
+                return
+            if data_type == pl.ENDSACC:
+                self.add(tracker.getFloatData())
+
+    def mark(self, name, tracker_time):
+        """Names a moment (in tracker time, ms) to get saccades since."""
+        self.marks[name] = tracker_time
+
+    def on_saccade(self, function, min_amplitude=0):
+        """Calls function(saccade, amplitude, direction) for every new saccade of at least
+        `min_amplitude` degrees."""
+        self.callbacks.append((min_amplitude, function))
+
+    def get_saccades(self, since=None, min_amplitude=0, eye=None):
+        """Returns all saccades that started after `since` (a tracker time or a marked name),
+        of at least `min_amplitude` degrees and made by `eye` (LEFT_EYE or RIGHT_EYE), along with
+        their amplitudes and directions.
+        Parameters:
+        since -- a tracker time in ms, or the name of a moment marked with `mark`
+        min_amplitude -- in degrees
+        eye -- LEFT_EYE, RIGHT_EYE or None for both
+        """
+        n_saccades = self.n_saccades
+        saccades = self.saccades[:n_saccades].copy()
+
+        if since is not None:
+            since = self.marks[since] if isinstance(since, str) else since
+            saccades = saccades[saccades['start'] >= since]
+        if eye is not None:
+            saccades = saccades[saccades['eye'] == eye]
+
+        amplitude, direction = get_amplitude_and_direction(saccades)
+        large_enough = amplitude >= min_amplitude
+        return saccades[large_enough], amplitude[large_enough], direction[large_enough]
+
+
+def _eye_to_values(eye_data):
+    """Returns the x, y and pupil size of one eye of a pylink sample."""
+    x, y = eye_data.getGaze()
+    if x == pl.MISSING_DATA:
+        x, y = np.nan, np.nan
+    return x, y, eye_data.getPupilSize()
+
+
+def _sample_to_row(sample):
+    """Converts a pylink sample to a row of SAMPLE_DTYPE."""
+    left = _eye_to_values(sample.getLeftEye()) if sample.isLeftSample() else (np.nan,) * 3
+    right = _eye_to_values(sample.getRightEye()) if sample.isRightSample() else (np.nan,) * 3
+    return (sample.getTime(), *left, *right)
+
+
+class LockedLink:
+    """Wraps a pylink tracker, so only one thread at a time can call it.
+    eyelink_core isn't thread-safe, but the link is used by the main thread (recording,
+     calibration), the link reader thread (see ConnectedEyeLinker.start_buffering) and the
+     trigger dispatcher (see eyetracker.py). Hold `lock` yourself to make several calls in a
+     row, e.g. getNextData and getFloatData.
+    """
+    def __init__(self, tracker, lock):
+        self._tracker = tracker
+        self.lock = lock
+
+    def __getattr__(self, name):
+        attribute = getattr(self._tracker, name)
+        if not callable(attribute):
+            return attribute
+
+        def locked(*args, **kwargs):
+            with self.lock:
+                return attribute(*args, **kwargs)
+        return locked
+
+
+# The connected tracker, if any, so the check functions below go through its lock too
+_connected_linker = None
+
+
 class ConnectedEyeLinker:
     """Returned if a connection is possible."""
     def __init__(self, window, filename, eye, text_color=None):
@@ -113,9 +298,14 @@ class ConnectedEyeLinker:
         self.edf_open = False
         self.eye = eye
         self.resolution = tuple(window.size)
-        self.tracker = pl.EyeLink()
+        self.link_lock = threading.RLock()
+        self.tracker = LockedLink(pl.EyeLink(), self.link_lock)
         self.genv = PsychoPyCustomDisplay(self.window, self.tracker)
         self.mock = False
+        self.samples = SampleBuffer()
+        self.saccades = SaccadeBuffer()
+        self.event_handlers = {pl.ENDSACC: self.saccades.add}
+        self.buffering = False
 
         if text_color is None:
             if all(i >= 0.5 for i in self.window.color):
@@ -125,6 +315,9 @@ class ConnectedEyeLinker:
         else:
             self.text_color = text_color
 
+        global _connected_linker
+        _connected_linker = self
+
     def initialize_graphics(self):
         """Opens the PsychoPyCustomDisplay object.
         Must be called during setup phase.
@@ -389,6 +582,51 @@ class ConnectedEyeLinker:
         else:
             return (sample.getLeftEye().getPupilSize(), sample.getRightEye().getPupilSize())
 
+    def start_buffering(self, capacity=16384):
+        """Starts a thread that continuously drains all data from the link.
+        Every sample goes into `samples`, a SampleBuffer, so none are lost between reads. Read
+         them with e.g. `tracker.samples.get_last(100)`. Events are passed on to the function in
+         `event_handlers` for their pylink data type, if there is one. By default, saccades go
+         into `saccades`, a SaccadeBuffer.
+        Stop buffering before calibrating, so the calibration gets the link to itself.
+        Parameters:
+        capacity -- the number of samples kept in the buffer
+        """
+        if self.buffering:
+            return
+
+        self.samples = SampleBuffer(capacity)
+        self.buffering = True
+        self.buffer_thread = threading.Thread(target=self._drain_link, daemon=True)
+        self.buffer_thread.start()
+
+    def stop_buffering(self):
+        """Stops the thread started by `start_buffering`, the buffer can still be read."""
+        if self.buffering:
+            self.buffering = False
+            self.buffer_thread.join()
+
+    def _drain_link(self):
+        while self.buffering:
+            # The data type and its data must come from the same call, so keep the link
+            with self.link_lock:
+                data_type = self.tracker.getNextData()
+                data = self.tracker.getFloatData() if data_type else None
+
+            # Nothing new on the link, try again in a bit
+            if not data_type:
+                time.sleep(.0005)
+                continue
+
+            if data_type == pl.SAMPLE_TYPE:
+                self.samples.write(_sample_to_row(data))
+            elif data_type in self.event_handlers:
+                self.event_handlers[data_type](data)
+
+    def tracker_time(self):
+        """Returns the current time on the tracker's clock, in ms."""
+        return self.tracker.trackerTime()
+
     def set_offline_mode(self):
         """Sets tracker to offline mode."""
         self.tracker.setOfflineMode()
@@ -523,29 +761,47 @@ def centerToTopLeft(pointXY, screenXY, flipY=False):
     return [newX, newY]
 
 
+def _get_link():
+    """Returns the link of the connected tracker, which locks every call, or pylink's."""
+    return _connected_linker.tracker if _connected_linker else pl.getEYELINK()
+
+
+# Saccades seen by check_sacc if nothing else reads the link, and how many saccades
+# of every buffer it has looked at
+_saccades = SaccadeBuffer()
+_n_checked_saccades = {}
+
 def check_sacc(Dis_sacc, startime = 0):
 
     ''' check for eye movements'''
-    
+
     # check recording eye
-    eye_used = pl.getEYELINK().eyeAvailable(); #determine which eye(s) are available 
+    eye_used = _get_link().eyeAvailable(); #determine which eye(s) are available 
     if eye_used == LEFT_EYE or eye_used == BINOCULAR: eye_used = LEFT_EYE
 
-    gotSac = False
-
-    d = pl.getEYELINK().getNextData()
-    if (d == 6) and (not gotSac):
-        newEvent = pl.getEYELINK().getFloatData()
-        if newEvent and (eye_used == newEvent.getEye()):
-            startLoc   = newEvent.getStartGaze()
-            endLoc     = newEvent.getEndGaze()
-            sacDist    = sqrt((startLoc[0] - endLoc[0])**2 + (startLoc[1] - endLoc[1])**2)
-            if sacDist >=Dis_sacc: 
-                gotSac = True
-                ref_time = pl.getEYELINK().trackerTime() - startime
-    if gotSac:
-        Value = [gotSac, sacDist, startLoc, endLoc, ref_time] 
+    # while the link reader thread runs, it has all saccades already,
+    # otherwise drain the whole link queue, so no saccade waits behind other data
+    if _connected_linker and _connected_linker.buffering:
+        saccades = _connected_linker.saccades
+    else:
+        saccades = _saccades
+        saccades.poll(_get_link())
+    n_checked = _n_checked_saccades.get(saccades, 0)
+    newSaccades = saccades.saccades[n_checked:saccades.n_saccades]
+    sacDists = np.hypot(newSaccades['end_x'] - newSaccades['start_x'],
+                        newSaccades['end_y'] - newSaccades['start_y'])
+    bigEnough = np.flatnonzero((newSaccades['eye'] == eye_used) & (sacDists >= Dis_sacc))
+
+    if len(bigEnough):
+        # report one saccade per call, later ones are reported by the next calls
+        _n_checked_saccades[saccades] = n_checked + bigEnough[0] + 1
+        saccade = newSaccades[bigEnough[0]]
+        startLoc = (saccade['start_x'], saccade['start_y'])
+        endLoc   = (saccade['end_x'], saccade['end_y'])
+        ref_time = _get_link().trackerTime() - startime
+        Value = [True, sacDists[bigEnough[0]], startLoc, endLoc, ref_time]
     else:
+        _n_checked_saccades[saccades] = n_checked + len(newSaccades)
         Value = [False, None, None, None, None]
     return Value
 
@@ -553,14 +809,14 @@ def check_fix(start_loc, fix_loc, acceptableDev, Dis_for_sacc, scnSize, startime
 
     ''' check for eye fixation for a spatial location'''
     
-    eye_used = pl.getEYELINK().eyeAvailable();
+    eye_used = _get_link().eyeAvailable();
     fix_loc = centerToTopLeft(fix_loc,scnSize )
     start_loc = centerToTopLeft(start_loc,scnSize )
 
     fixAcquired = False;fix4Target = False
     if fix_loc:
         fix_loc = [fix_loc[0],fix_loc[1]]
-        dt = pl.getEYELINK().getNewestSample() # check for new sample update
+        dt = _get_link().getNewestSample() # check for new sample update
         if(dt != None):
             # Gets the gaze position of the latest sample,
             if eye_used == RIGHT_EYE and dt.isRightSample():
@@ -574,7 +830,7 @@ def check_fix(start_loc, fix_loc, acceptableDev, Dis_for_sacc, scnSize, startime
                 ref_time = None
             if gazeDev < acceptableDev: 
                 fix4Target = True
-                ref_time =  pl.getEYELINK().trackerTime() - startime
+                ref_time =  _get_link().trackerTime() - startime
                 
     if fixAcquired or fix4Target:
         gazePos = topLeftToCenter(gazePos,scnSize)
@@ -596,7 +852,7 @@ def checkKeyEvent(KEYS_ALLOWED,TERMINATE_UPON_RESP,startime):
             if (TERMINATE_UPON_RESP == True) and (keycode in KEYS_ALLOWED):
                 gotKey   = True
                 respKey  = pygame.key.name(keycode)
-                respTime = pl.getEYELINK().trackerTime()
+                respTime = _get_link().trackerTime()
             if keycode == K_ESCAPE: escapePressed = True
 
     if gotKey:
@@ -606,18 +862,18 @@ def checkKeyEvent(KEYS_ALLOWED,TERMINATE_UPON_RESP,startime):
 
 def offline_mode_start():
      ## force off-line mode first to prevent eyelink freeze
-    pl.getEYELINK().setOfflineMode();
+    _get_link().setOfflineMode();
     pl.msecDelay(50);
 
     ## start recording
-    error = pl.getEYELINK().startRecording(1,1,1,1)
+    error = _get_link().startRecording(1,1,1,1)
     if error: return error
     ## wait for 100 ms to prevent data loss
     pl.msecDelay(100); 
 
     ## send the "SYNCTIME" message to mark the zero time of a trial
-    currentTime = pl.getEYELINK().trackerTime()
-    pl.getEYELINK().sendMessage("SYNCTIME %d"%currentTime)
+    currentTime = _get_link().trackerTime()
+    _get_link().sendMessage("SYNCTIME %d"%currentTime)
 
 # Creates a mock object to be used if tracker doesn't connect for debug purposes
 _method_list = [fn_name for fn_name in dir(ConnectedEyeLinker)
@@ -641,6 +897,10 @@ class MockEyeLinker:
         self.gaze_data = (None, None)
         self.pupil_size = (None, None)
         self.mock = True
+        self.samples = SampleBuffer()
+        self.saccades = SaccadeBuffer()
+        self.event_handlers = {}
+        self.buffering = False
 
         if text_color is None:
             if all(i >= 0.5 for i in self.window.color):
@@ -6,18 +6,31 @@ see README.md for instructions if needed
 """
 
 # Import necessary stuff
-from psychopy import core
-import pandas as pd
-from participantinfo import get_participant_details
+import os
+from participantinfo import (
+    get_participant_details,
+    update_trials_completed,
+    register_progress,
+    export_participants,
+)
 from set_up import get_monitor_and_dir, get_settings
 from eyetracker import Eyelinker
-from trial import single_trial, generate_stimuli_characteristics
-from time import time
+from trial import single_trial, prerender_feedback
 from practice import practice
+from fliplog import FlipLog
+from datawriter import TrialWriter, rebuild_csv
+from ioworker import IOWorker
+from fixation import FixationMonitor
+from schedule import (
+    compile_schedule,
+    get_blocks,
+    get_stimuli_characteristics,
+    save_schedule,
+)
 import datetime as dt
+import numpy as np
+import random
 from block import (
-    create_blocks,
-    create_trials_in_block,
     block_break,
     long_break,
     finish,
@@ -26,97 +39,146 @@ from block import (
 
 N_BLOCKS = 24
 TRIALS_PER_BLOCK = 36
+FLUSH_EVERY = 6  # trials, data is also flushed at the end of every block
+REPEAT_BROKEN_FIXATIONS = True  # repeat trials without fixation at the end of the block
+MAX_REPEATS_PER_BLOCK = 6
+TIMESTAMPED_RESPONSE = False  # time responses with the keyboard's own timestamps
 
 
-def main():
+def main(testing=False, headless=False, directory=None):
     """
+    Set `testing` for a short test run without eyetracker.
+    Set `headless` to run the whole session without screen, keyboard or eyetracker
+    on simulated flips and a virtual clock (see virtual.py), optionally in
+    another `directory` than the one from `get_monitor_and_dir`.
+
     Data formats / storage:
      - eyetracking data saved in one .edf file per session
-     - all trial data saved in one .csv per session
-     - subject data in one .csv (for all sessions combined)
+       (convert it for analysis with edfconvert.py)
+     - all trial data appended to one .jsonl per session while running,
+       and saved in one .csv per session at the end
+     - the seeded trial schedule saved in one .npz per session
+     - the timestamp of every flip saved in one .dat per session (see fliplog.py)
+     - subject data in one registry shared by all booths (see participantinfo.py),
+       exported to one .csv (for all sessions combined) at the end of every session
     """
 
-    # Set whether this is a test run or not
-    testing = False
-
     # Get monitor and directory information
-    monitor, directory = get_monitor_and_dir(testing)
-
-    # Get participant details and save in same file as before
-    old_participants = pd.read_csv(
-        rf"{directory}\participantinfo.csv",
-        dtype={
-            "participant_number": int,
-            "session_number": int,
-            "age": int,
-            "trials_completed": str,
-        },
+    monitor, default_directory = get_monitor_and_dir(testing)
+    directory = directory or default_directory
+
+    # Get participant details and register them right away, so other booths can't
+    # get the same numbers
+    participant_number, session_number = get_participant_details(
+        directory, testing or headless
     )
-    new_participants = get_participant_details(old_participants, testing)
 
     # Initialise set-up
-    settings = get_settings(monitor, directory)
+    settings = get_settings(monitor, directory, headless, TIMESTAMPED_RESPONSE)
+    session = f"session_{session_number}{'_test' if testing else ''}"
+    prerender_feedback(settings)
 
     # Connect to eyetracker and calibrate it
-    if not testing:
+    eyelinker = None
+    if not testing and not headless:
         eyelinker = Eyelinker(
-            new_participants.participant_number.iloc[-1],
-            new_participants.session_number.iloc[-1],
+            participant_number,
+            session_number,
             settings["window"],
             settings["directory"],
         )
         eyelinker.calibrate()
 
     # Start recording eyetracker
-    if not testing:
+    if eyelinker:
         eyelinker.start()
 
     # Practice until participant wants to stop
     practice(testing, settings)
 
+    # Write all data on a background thread, so it never delays a flip
+    io_worker = settings["io_worker"] = IOWorker()
+
+    # Record every flip from now on
+    settings["flip_log"] = FlipLog(
+        os.path.join(settings["directory"], f"flips_{session}.dat"),
+        settings["refresh_rate"],
+        io_worker,
+    )
+
+    # Check fixation online from now on
+    if eyelinker:
+        settings["fixation_monitor"] = FixationMonitor(eyelinker.tracker, settings)
+
     # Initialise some stuff
-    start_of_experiment = time()
-    data = []
+    start_of_experiment = settings["clock"].time()
+    writer = TrialWriter(
+        os.path.join(settings["directory"], f"data_{session}.jsonl"), FLUSH_EVERY
+    )
     current_trial = 0
     finished_early = True
 
     # Start experiment
     try:
-        # Generate pseudo-random order of blocks
-        blocks = create_blocks(N_BLOCKS)
-
-        for block_nr, block_type in (
-            [(1, ("predictable", "early")), (2, ("unpredictable", 0))]
-            if testing
-            else blocks
-        ):
-            # Pseudo-randomly create conditions and target locations (so they're weighted)
-            trials = create_trials_in_block(TRIALS_PER_BLOCK, block_type)
+        # Generate pseudo-random order of blocks and all trials within them at once
+        seed = random.randrange(2**32)
+        schedule = compile_schedule(
+            N_BLOCKS,
+            TRIALS_PER_BLOCK,
+            seed,
+            (
+                [(1, ("predictable", "early")), (2, ("unpredictable", 0))]
+                if testing
+                else None
+            ),
+        )
+        save_schedule(
+            schedule,
+            seed,
+            os.path.join(settings["directory"], f"schedule_{session}.npz"),
+        )
 
+        for block_nr, block_type in get_blocks(schedule):
             # Run trials per pseudo-randomly created info
-            for location, congruency, flicker_type, cue_timing in trials:
+            block_indices = list(np.flatnonzero(schedule["block"] == block_nr))
+            repeats_left = MAX_REPEATS_PER_BLOCK
+
+            # Trials added to the list while running are run at the end of the block
+            for index in block_indices:
                 current_trial += 1
-                start_time = time()
+                settings["flip_log"].start_trial(current_trial)
+                start_time = settings["clock"].time()
 
-                stimuli_characteristics: dict = generate_stimuli_characteristics(
-                    congruency, location, flicker_type, cue_timing, block_type[0]
+                stimuli_characteristics: dict = get_stimuli_characteristics(
+                    schedule, index
                 )
 
                 # Generate trial
                 report: dict = single_trial(
                     **stimuli_characteristics,
                     settings=settings,
-                    testing=testing,
-                    eyetracker=None if testing else eyelinker,
+                    testing=eyelinker is None,
+                    eyetracker=eyelinker,
                 )
-                end_time = time()
+                end_time = settings["clock"].time()
+
+                # Repeat the exact same trial later on, so all conditions stay balanced
+                if (
+                    REPEAT_BROKEN_FIXATIONS
+                    and report["fixation_broken"]
+                    and repeats_left
+                ):
+                    block_indices.append(index)
+                    repeats_left -= 1
 
                 # Save trial data
-                data.append(
+                io_worker.submit(
+                    writer.write,
                     {
                         "trial_number": current_trial,
                         "block_type": block_type,
                         "block": block_nr,
+                        "schedule_index": int(index),
                         "start_time": str(
                             dt.timedelta(seconds=(start_time - start_of_experiment))
                         ),
@@ -125,18 +187,24 @@ def main():
                         ),
                         **stimuli_characteristics,
                         **report,
-                    }
+                        "io_queue_depth": io_worker.depth,
+                    },
                 )
 
+            # Only register progress between blocks, as the registry may be locked by
+            # another booth for a while
+            io_worker.submit(writer.flush)
+            io_worker.submit(
+                register_progress, directory, session_number, current_trial
+            )
+
             # Break after end of block, unless it's the last block.
             # Experimenter can re-calibrate the eyetracker by pressing 'c' here.
             calibrated = True
             if block_nr == N_BLOCKS // 2:
                 while calibrated:
-                    calibrated = long_break(
-                        N_BLOCKS, settings, eyetracker=None if testing else eyelinker
-                    )
-                if not testing:
+                    calibrated = long_break(N_BLOCKS, settings, eyetracker=eyelinker)
+                if eyelinker:
                     eyelinker.start()
             elif block_nr < N_BLOCKS:
                 while calibrated:
@@ -144,31 +212,35 @@ def main():
                         block_nr,
                         N_BLOCKS,
                         settings,
-                        eyetracker=None if testing else eyelinker,
+                        eyetracker=eyelinker,
                     )
 
         finished_early = False
 
     finally:
         # Stop eyetracker (this should also save the data)
-        if not testing:
+        if eyelinker:
             eyelinker.stop()
 
-        # Save all collected trial data to a new .csv
-        pd.DataFrame(data).to_csv(
-            rf"{settings['directory']}\data_session_{new_participants.session_number.iloc[-1]}{'_test' if testing else ''}.csv",
-            index=False,
-        )
+        # Save the flips of the last trial
+        settings["flip_log"].save()
 
-        # Register how many trials this participant has completed
-        new_participants.loc[new_participants.index[-1], "trials_completed"] = str(
-            len(data)
-        )
+        # Finish all background writing, then save all collected trial data to a new .csv.
+        # If any background write failed, the first error is raised once everything is saved.
+        try:
+            io_worker.close()
+        finally:
+            writer.close()
+            rebuild_csv(
+                os.path.join(settings["directory"], f"data_{session}.jsonl"),
+                os.path.join(settings["directory"], f"data_{session}.csv"),
+            )
 
-        # Save participant data to existing .csv file
-        new_participants.to_csv(
-            rf"{settings['directory']}\participantinfo.csv", index=False
-        )
+            # Register how many trials this participant has completed
+            update_trials_completed(directory, session_number, writer.n_written)
+
+            # Save all participant data to the existing .csv file as well
+            export_participants(directory)
 
         # Done!
         if finished_early:
@@ -176,7 +248,10 @@ def main():
         else:
             finish(N_BLOCKS, settings)
 
-        core.quit()
+        if not headless:
+            from psychopy import core
+
+            core.quit()
 
     # Thanks for meedoen
 
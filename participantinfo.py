@@ -6,32 +6,216 @@ To run the 'unpredictable flickering null-cue experiment', see main.py.
 made by Anna van Harmelen, 2024
 """
 
+import os
 import random
+import sqlite3
+from contextlib import contextmanager
 import pandas as pd
 
+REGISTRY_FILE = "participants.sqlite"
+CSV_FILE = "participantinfo.csv"
 
-def get_participant_details(existing_participants: pd.DataFrame, testing):
-    # Generate random & unique participant number
-    participant = random.randint(10, 99)
-    while participant in existing_participants.participant_number.tolist():
-        participant = random.randint(10, 99)
+# The rollback journal also works when the booths share the data folder over the
+# network. "WAL" lets booths read while another one writes, but only use it when all
+# booths run on the computer that holds the data folder, or writes can get lost.
+JOURNAL_MODE = "DELETE"
 
-    print(f"Participant number: {participant}")
+PARTICIPANT_COLUMNS = {
+    "participant_number": int,
+    "session_number": int,
+    "age": int,
+    "trials_completed": str,
+}
+
+# The .edf is called f"{session}_{participant}.edf" and may be at most 12 characters
+# long (see lib/eyelinker.py), so this leaves room for up to 999 sessions
+PARTICIPANT_DIGITS = 4
+MAX_EDF_FILENAME_LENGTH = 12
+
+
+def allocate_participant_number(taken: set, digits=PARTICIPANT_DIGITS, rng=random):
+    """Return a random participant number of `digits` digits that isn't in `taken`."""
+    id_space = range(10 ** (digits - 1), 10**digits)
+    n_taken = sum(1 for participant in taken if participant in id_space)
+
+    if n_taken >= len(id_space):
+        raise RuntimeError(
+            f"All {len(id_space)} participant numbers of {digits} digits are taken, "
+            "increase PARTICIPANT_DIGITS (if the .edf filename still fits)"
+        )
+
+    # Guessing is quick while most numbers are free, otherwise pick from the free ones
+    if n_taken < len(id_space) // 2:
+        participant = rng.choice(id_space)
+        while participant in taken:
+            participant = rng.choice(id_space)
+        return participant
+
+    return rng.choice(sorted(set(id_space) - taken))
+
+
+def check_edf_filename(session, participant):
+    filename = f"{session}_{participant}.edf"
+
+    if len(filename) > MAX_EDF_FILENAME_LENGTH:
+        raise ValueError(
+            f"The .edf filename {filename} is longer than {MAX_EDF_FILENAME_LENGTH} "
+            "characters, decrease PARTICIPANT_DIGITS"
+        )
+
+
+@contextmanager
+def open_registry(directory):
+    """
+    usage:
+
+       with open_registry(directory) as registry:
+           registry.execute(...)
+
+    Opens the participant registry that all booths share, in one transaction
+    that locks it for writing right away (so no other booth can hand out the
+    same numbers in between) and is committed at the end.
+    The registry starts with everyone already in participantinfo.csv.
+    """
+    registry = sqlite3.connect(
+        os.path.join(directory, REGISTRY_FILE), timeout=30, isolation_level=None
+    )
+
+    try:
+        registry.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+        registry.execute("BEGIN IMMEDIATE")
+
+        try:
+            registry.execute(
+                "CREATE TABLE IF NOT EXISTS participants ("
+                "participant_number INTEGER NOT NULL, "
+                "session_number INTEGER NOT NULL, "
+                "age INTEGER NOT NULL, "
+                "trials_completed TEXT)"
+            )
+            import_csv(directory, registry)
+
+            yield registry
+
+        except BaseException:
+            registry.execute("ROLLBACK")
+            raise
+
+        registry.execute("COMMIT")
+
+    finally:
+        registry.close()
+
+
+def import_csv(directory, registry):
+    # Only once, when the registry is still empty
+    path = os.path.join(directory, CSV_FILE)
+
+    if registry.execute("SELECT 1 FROM participants").fetchone() or not os.path.exists(
+        path
+    ):
+        return
+
+    participants = pd.read_csv(path, dtype=PARTICIPANT_COLUMNS)[
+        list(PARTICIPANT_COLUMNS)
+    ]
 
+    # Booths used to rewrite the .csv at the same time, which could give two sessions
+    # the same number. Keep them all, new sessions get numbers above them anyway.
+    duplicates = participants[participants.session_number.duplicated(keep=False)]
+    if len(duplicates):
+        print(
+            f"{CSV_FILE} has {len(duplicates)} rows with the same session number:\n"
+            f"{duplicates.to_string(index=False)}"
+        )
+
+    participants = participants.astype(object)
+
+    registry.executemany(
+        "INSERT INTO participants VALUES (?, ?, ?, ?)",
+        participants.where(participants.notna(), None).itertuples(index=False),
+    )
+
+
+def get_participants(registry):
+    return pd.read_sql_query(
+        "SELECT * FROM participants ORDER BY session_number, rowid", registry
+    ).astype(PARTICIPANT_COLUMNS)
+
+
+def read_participants(directory):
+    with open_registry(directory) as registry:
+        return get_participants(registry)
+
+
+def register_session(directory, age):
+    """Allocate a new participant and session number at once and register them."""
+    with open_registry(directory) as registry:
+        participant = allocate_participant_number(
+            {
+                participant
+                for (participant,) in registry.execute(
+                    "SELECT participant_number FROM participants"
+                )
+            }
+        )
+
+        (session,) = registry.execute(
+            "SELECT COALESCE(MAX(session_number), 0) + 1 FROM participants"
+        ).fetchone()
+        check_edf_filename(session, participant)
+
+        registry.execute(
+            "INSERT INTO participants VALUES (?, ?, ?, '0')",
+            (participant, session, age),
+        )
+
+    return participant, session
+
+
+def update_trials_completed(directory, session, trials_completed):
+    with open_registry(directory) as registry:
+        registry.execute(
+            "UPDATE participants SET trials_completed = ? WHERE session_number = ?",
+            (str(trials_completed), session),
+        )
+
+
+def register_progress(directory, session, trials_completed):
+    """
+    Like update_trials_completed, but skipped if another booth keeps the registry
+    locked too long, as the final count is registered at the end of the session anyway.
+    """
+    try:
+        update_trials_completed(directory, session, trials_completed)
+    except sqlite3.OperationalError as error:
+        print(f"Couldn't register progress of session {session}: {error}")
+
+
+def export_participants(directory):
+    """
+    Keep participantinfo.csv in the same format as before, for analyses.
+    It's written while the registry is locked, to a temporary file that then
+    replaces it at once, so booths finishing together can't mix up the file.
+    """
+    path = os.path.join(directory, CSV_FILE)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+
+    with open_registry(directory) as registry:
+        get_participants(registry).to_csv(temporary_path, index=False)
+        os.replace(temporary_path, path)
+
+
+def get_participant_details(directory, testing):
     if not testing:
         # Get participant age
         age = int(input("Participant age: "))
     else:
         age = 00
 
-    # Insert session number
-    session = max(existing_participants.session_number) + 1
+    # Generate random & unique participant number and the next session number
+    participant, session = register_session(directory, age)
 
-    new_participant = pd.DataFrame(
-        {"age": [age], "participant_number": [participant], "session_number": [session]}
-    )
-    all_participants = pd.concat(
-        [existing_participants, new_participant], ignore_index=True
-    )
+    print(f"Participant number: {participant}")
 
-    return all_participants
+    return participant, session
@@ -13,8 +13,6 @@ from trial import (
 )
 from stimuli import make_one_bar, create_fixation_dot
 from response import get_response, wait_for_key
-from psychopy.hardware.keyboard import Keyboard
-from time import sleep
 import random
 
 # 1. Practice response dials using a block with a specific orientation
@@ -26,7 +24,7 @@ def practice(testing, settings):
     show_text(
         f"Welcome to the practice trials. You will practice each part until you press Q. \
             \nPress SPACE to start the practice session.",
-        settings["window"],
+        settings,
     )
     settings["window"].flip()
     wait_for_key(["space"], settings["keyboard"])
@@ -57,18 +55,18 @@ def practice(testing, settings):
             create_fixation_dot(settings)
             show_text(
                 f"{report['performance']}",
-                settings["window"],
+                settings,
                 (0, settings["deg2pix"](0.5)),
             )
             settings["window"].flip()
-            sleep(0.5)
+            settings["clock"].wait(0.5)
 
     except KeyboardInterrupt:
         show_text(
             "You decided to stop practising the response dial. "
             "Press SPACE to start practising full trials."
             "\nRemember to press Q to stop practising these trials once you feel comfortable starting the real experiment.",
-            settings["window"],
+            settings,
         )
         settings["window"].flip()
         wait_for_key(["space"], settings["keyboard"])
@@ -90,7 +88,7 @@ def practice(testing, settings):
     except KeyboardInterrupt:
         show_text(
             f"You decided to stop practising the trials.\nPress SPACE to start the experiment.",
-            settings["window"],
+            settings,
         )
         settings["window"].flip()
 
@@ -6,29 +6,49 @@ To run the 'unpredictable flickering null-cue experiment', see main.py.
 made by Anna van Harmelen, 2024
 """
 
-from psychopy import core, visual, event
-from psychopy.hardware.keyboard import Keyboard
-from math import cos, sin, degrees
+from typing import TYPE_CHECKING
+from math import degrees
+import numpy as np
 from stimuli import create_fixation_dot
-from time import time
 from eyetracker import get_trigger
+from fliplog import flip
+
+if TYPE_CHECKING:
+    from psychopy.hardware.keyboard import Keyboard
 
 RESPONSE_DIAL_SIZE = 2
+DIAL_KEYS = ("z", "m")  # anticlockwise, clockwise
 
 
-def turn_handle(pos, dial_step_size):
-    x, y = pos
-    pos = (
-        x * cos(dial_step_size) + y * sin(dial_step_size),
-        -x * sin(dial_step_size) + y * cos(dial_step_size),
-    )
+def make_dial_trajectory(deg2pix, dial_step_size, max_turns):
+    """
+    Return the orientation of the dial (in degrees) and the (x, y) position of
+    both handles after every possible number of turns, for both rotation keys:
+    orientations[key, turns] and positions[key, turns, handle], where key is
+    the index in DIAL_KEYS and handle 0 is the top one.
+    Computed once per session, so the dial never drifts from the reported orientation.
+    """
+    angles = np.outer([-1, 1], np.arange(max_turns + 1) * dial_step_size)
+
+    radius = deg2pix(RESPONSE_DIAL_SIZE)
+    top = np.stack([radius * np.sin(angles), radius * np.cos(angles)], axis=-1)
+    positions = np.stack([top, -top], axis=2)
+
+    orientations = np.degrees(angles)
+    orientations.flags.writeable = False
+    positions.flags.writeable = False
 
-    # centre, distance, rad
-    return pos
+    return {"orientations": orientations, "positions": positions}
 
 
-def get_report_orientation(key, turns, dial_step_size):
-    report_orientation = degrees(turns * dial_step_size)
+def get_report_orientation(key, turns, dial_trajectory):
+    return float(dial_trajectory["orientations"][DIAL_KEYS.index(key), turns])
+
+
+def get_held_orientation(key, hold_duration, settings):
+    # The dial turns a quarter circle per second, for at most one second
+    turns = min(hold_duration, 1) * settings["monitor"]["Hz"]
+    report_orientation = degrees(turns * settings["dial_step_size"])
 
     if key == "z":
         report_orientation *= -1
@@ -36,6 +56,12 @@ def get_report_orientation(key, turns, dial_step_size):
     return report_orientation
 
 
+def get_press_time(press, keyboard, flip_clock):
+    # Key events are timestamped relative to the keyboard's own clock,
+    # which needn't have been reset at the same time as the clock of the flips
+    return keyboard.clock.getLastResetTime() + press.rt - flip_clock.getLastResetTime()
+
+
 def evaluate_response(report_orientation, target_orientation, key):
     report_orientation = round(report_orientation)
 
@@ -62,7 +88,7 @@ def evaluate_response(report_orientation, target_orientation, key):
 
 
 def make_circle(rad, settings, colour="#d4d4d4", pos=(0, 0), handle=False):
-    circle = visual.Circle(
+    circle = settings["visual"].Circle(
         win=settings["window"],
         radius=settings["deg2pix"](rad),
         edges=settings["deg2pix"](1),
@@ -110,32 +136,40 @@ def get_response(
     flicker_type,
     target_bar,
     additional_objects=[],
+    probe_onset=None,
 ):
+    """
+    If settings["timestamped_response"] is set, the idle reaction time is measured
+    from `probe_onset` (the flip time of the probe cue) to the key press, and the
+    response time and reported orientation follow from how long the key was held,
+    all as timestamped by the keyboard. Otherwise, they're measured per frame.
+    """
     keyboard: Keyboard = settings["keyboard"]
-    window = settings["window"]
+    clock = settings["clock"]
 
     keyboard.clearEvents()
     turns = 0
 
+    # In practice, the dial is shown around a single bar instead of after a probe cue
     for item in additional_objects:
         item.draw()
-        window.flip()
+        probe_onset = flip(settings, "response")
 
-    idle_reaction_time_start = time()
+    idle_reaction_time_start = clock.time()
 
-    # Wait indefinitely until the participant starts giving an answer
+    # Wait indefinitely until the participant starts giving an answer,
+    # keep the key press so its release can be detected below
     keyboard.clearEvents()  # do it again to be sure
-    pressed = event.waitKeys(keyList=["z", "m", "q"])
+    presses = keyboard.waitKeys(keyList=["z", "m", "q"], waitRelease=False, clear=False)
+    pressed = [press.name for press in presses]
 
-    response_started = time()
+    response_started = clock.time()
     idle_reaction_time = response_started - idle_reaction_time_start
 
     if "m" in pressed:
         key = "m"
-        rad = settings["dial_step_size"]
     elif "z" in pressed:
         key = "z"
-        rad = -settings["dial_step_size"]
     if "q" in pressed:
         raise KeyboardInterrupt()
 
@@ -146,45 +180,68 @@ def get_response(
     dial_circle, top_dial, bottom_dial = make_dial(target_colour, settings)
 
     if not testing and eyetracker:
-        trigger = get_trigger("response_onset", predictability, cue_timing, trial_condition, flicker_type, target_bar)
-        eyetracker.tracker.send_message(f"trig{trigger}")
+        trigger = get_trigger(
+            "response_onset",
+            predictability,
+            cue_timing,
+            trial_condition,
+            flicker_type,
+            target_bar,
+        )
+        eyetracker.send_trigger(trigger)
+
+    positions = settings["dial_trajectory"]["positions"][DIAL_KEYS.index(key)]
 
-    while not keyboard.getKeys(keyList=[key]) and turns < settings["monitor"]["Hz"]:
-        top_dial.pos = turn_handle(top_dial.pos, rad)
-        bottom_dial.pos = turn_handle(bottom_dial.pos, rad)
+    released = keyboard.getKeys(keyList=[key])
 
+    while not released and turns < settings["monitor"]["Hz"]:
         turns += 1
 
+        top_dial.pos = positions[turns, 0]
+        bottom_dial.pos = positions[turns, 1]
+
         for item in additional_objects:
             item.draw()
 
         dial_circle.draw()
         top_dial.draw()
         bottom_dial.draw()
-        
+
         if not additional_objects:
             create_fixation_dot(settings)
 
-        window.flip()
+        flip(settings, "response")
+
+        released = keyboard.getKeys(keyList=[key])
+
+    response_time = clock.time() - response_started
+    report_orientation = get_report_orientation(key, turns, settings["dial_trajectory"])
+
+    timestamped = settings["timestamped_response"] and probe_onset is not None
+    if timestamped:
+        press = next(press for press in presses if press.name == key)
+        idle_reaction_time = (
+            get_press_time(press, keyboard, settings["flip_clock"]) - probe_onset
+        )
 
-    response_time = time() - response_started
+        # A key still held after a full turn has no release time yet, so keep the frame count
+        if released:
+            response_time = released[0].duration
+            report_orientation = get_held_orientation(key, response_time, settings)
 
     return {
         "idle_reaction_time_in_ms": round(idle_reaction_time * 1000, 2),
         "response_time_in_ms": round(response_time * 1000, 2),
+        "timestamped_response": timestamped,
         "key_pressed": key,
         "turns_made": turns,
-        **evaluate_response(
-            get_report_orientation(key, turns, settings["dial_step_size"]),
-            target_orientation,
-            key,
-        ),
+        **evaluate_response(report_orientation, target_orientation, key),
     }
 
 
 def wait_for_key(key_list, keyboard):
     keyboard: Keyboard = keyboard
     keyboard.clearEvents()
-    keys = event.waitKeys(keyList=key_list)
+    keys = [key.name for key in keyboard.waitKeys(keyList=key_list, waitRelease=False)]
 
     return keys
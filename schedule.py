@@ -0,0 +1,104 @@
+"""
+This file contains the functions necessary for
+compiling the full, seeded trial schedule of a session before it starts.
+To run the 'unpredictable flickering null-cue experiment', see main.py.
+
+made by Anna van Harmelen, 2024
+"""
+
+import random
+import numpy as np
+from block import BLOCK_TYPES, create_blocks, create_trials_in_block
+from trial import draw_stimuli, derive_stimuli_characteristics
+
+LOCATIONS = ("left", "right")
+CONGRUENCIES = ("congruent", "incongruent")
+FLICKER_TYPES = ("stable", "high_freq", "low_freq")
+CUE_TIMINGS = ("early", "middle", "late")
+
+# One row per trial, all conditions are stored as indices into the lists above
+SCHEDULE_DTYPE = np.dtype(
+    [
+        ("block", "u1"),
+        ("block_type", "u1"),
+        ("target_bar", "u1"),
+        ("trial_condition", "u1"),
+        ("flicker_type", "u1"),
+        ("cue_timing", "u1"),
+        ("left_colour", "u1"),
+        ("right_colour", "u1"),
+        ("left_orientation", "i1"),
+        ("right_orientation", "i1"),
+        ("ITI", "u2"),  # in ms
+    ]
+)
+
+
+def compile_schedule(n_blocks, trials_per_block, seed, blocks=None):
+    """
+    Generate every trial of the session up front from a single seed.
+    Pass `blocks` as a list of (block number, block type) to skip the
+    pseudo-random block order (e.g. when testing).
+    """
+    rng = random.Random(seed)
+
+    if blocks is None:
+        blocks = create_blocks(n_blocks, rng)
+
+    schedule = np.zeros(len(blocks) * trials_per_block, dtype=SCHEDULE_DTYPE)
+    row = 0
+
+    for block_nr, block_type in blocks:
+        for location, congruency, flicker_type, cue_timing in create_trials_in_block(
+            trials_per_block, block_type, rng
+        ):
+            colour_indices, orientations, iti = draw_stimuli(rng)
+
+            schedule[row] = (
+                block_nr,
+                BLOCK_TYPES.index(block_type),
+                LOCATIONS.index(location),
+                CONGRUENCIES.index(congruency),
+                FLICKER_TYPES.index(flicker_type),
+                CUE_TIMINGS.index(cue_timing),
+                *colour_indices,
+                *orientations,
+                iti,
+            )
+            row += 1
+
+    return schedule
+
+
+def get_blocks(schedule):
+    """Return the (block number, block type) pairs of a schedule, in order."""
+    _, first_rows = np.unique(schedule["block"], return_index=True)
+
+    return [
+        (int(schedule["block"][row]), BLOCK_TYPES[schedule["block_type"][row]])
+        for row in sorted(first_rows)
+    ]
+
+
+def get_stimuli_characteristics(schedule, index):
+    row = schedule[index]
+
+    return derive_stimuli_characteristics(
+        CONGRUENCIES[row["trial_condition"]],
+        LOCATIONS[row["target_bar"]],
+        FLICKER_TYPES[row["flicker_type"]],
+        CUE_TIMINGS[row["cue_timing"]],
+        BLOCK_TYPES[row["block_type"]][0],
+        int(row["ITI"]),
+        (int(row["left_colour"]), int(row["right_colour"])),
+        (int(row["left_orientation"]), int(row["right_orientation"])),
+    )
+
+
+def save_schedule(schedule, seed, path):
+    np.savez(path, schedule=schedule, seed=seed)
+
+
+def load_schedule(path):
+    with np.load(path) as stored:
+        return stored["schedule"], int(stored["seed"])
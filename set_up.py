@@ -6,9 +6,12 @@ To run the 'unpredictable flickering null-cue experiment', see main.py.
 made by Anna van Harmelen, 2024
 """
 
-from psychopy import visual
-from psychopy.hardware.keyboard import Keyboard
 from math import degrees, atan2, pi
+from time import time
+from types import SimpleNamespace
+import virtual
+from simulated_participant import SimulatedParticipant
+from response import make_dial_trajectory
 
 
 def get_monitor_and_dir(testing: bool):
@@ -37,25 +40,65 @@ def get_monitor_and_dir(testing: bool):
     return monitor, directory
 
 
-def get_settings(monitor: dict, directory):
-    window = visual.Window(
-        color=("#7F7F7F"),
-        size=monitor["resolution"],
-        units="pix",
-        fullscr=True,
-    )
+def get_settings(monitor: dict, directory, headless=False, timestamped_response=False):
+    """
+    Set `headless` to run without a screen or keyboard: flips are then simulated
+    at monitor["Hz"], all waiting happens on a virtual clock (see virtual.py)
+    and a simulated participant does the task (see simulated_participant.py).
+    Set `timestamped_response` to time responses with the keyboard's own press
+    and release timestamps instead of per frame (see response.py).
+    """
+    # move the dial a quarter circle per second
+    dial_step_size = (0.5 * pi) / monitor["Hz"]
+
+    if headless:
+        clock = flip_clock = virtual.VirtualClock()
+        window = virtual.VirtualWindow(
+            monitor["resolution"], "#7F7F7F", monitor["Hz"], clock
+        )
+        keyboard = SimulatedParticipant(window, dial_step_size)
+        mouse = None
+        stimuli = virtual.visual
+    else:
+        # Only needed with a screen, so headless sessions run without psychopy
+        from psychopy import core, visual
+        from psychopy.hardware.keyboard import Keyboard
+
+        clock = SimpleNamespace(time=time, wait=core.wait)
+        # window.flip() returns the time on this clock
+        flip_clock = core.monotonicClock
+        window = visual.Window(
+            color=("#7F7F7F"),
+            size=monitor["resolution"],
+            units="pix",
+            fullscr=True,
+        )
+        keyboard = Keyboard()
+        mouse = visual.CustomMouse(win=window, visible=False)
+        stimuli = visual
+
+    # Use the measured refresh rate for everything that is timed in frames
+    refresh_rate = window.getActualFrameRate() or monitor["Hz"]
 
     degrees_per_pixel = degrees(atan2(0.5 * monitor["width"], monitor["distance"])) / (
         0.5 * monitor["resolution"][0]
     )
 
+    deg2pix = lambda deg: round(deg / degrees_per_pixel)
+
     return dict(
-        deg2pix=lambda deg: round(deg / degrees_per_pixel),
-        # move the dial a quarter circle per second
-        dial_step_size=(0.5 * pi) / monitor["Hz"],
+        deg2pix=deg2pix,
+        dial_step_size=dial_step_size,
+        dial_trajectory=make_dial_trajectory(deg2pix, dial_step_size, monitor["Hz"]),
         window=window,
-        keyboard=Keyboard(),
-        mouse=visual.CustomMouse(win=window, visible=False),
+        keyboard=keyboard,
+        mouse=mouse,
+        visual=stimuli,
+        clock=clock,
+        flip_clock=flip_clock,
+        headless=headless,
+        timestamped_response=timestamped_response,
         monitor=monitor,
+        refresh_rate=refresh_rate,
         directory=directory,
     )
@@ -0,0 +1,104 @@
+"""
+This file contains the functions necessary for
+letting a simulated participant do the experiment, e.g. for unattended load and timing tests.
+The participant watches the (virtual) screen, remembers the bars it saw and reports the
+orientation of the bar with the colour of the probe cue, with some noise.
+To run the 'unpredictable flickering null-cue experiment', see main.py.
+
+made by Anna van Harmelen, 2024
+"""
+
+import random
+from math import degrees
+from virtual import Circle, Rect, VirtualKeyboard, VirtualWindow
+
+
+def as_key(colour):
+    # Colours are lists (unhashable) or strings
+    return tuple(colour) if isinstance(colour, (list, tuple)) else colour
+
+
+class SimulatedParticipant(VirtualKeyboard):
+    """
+    usage:
+
+       settings = get_settings(monitor, directory, headless=True)
+       settings["keyboard"] = SimulatedParticipant(
+           settings["window"], settings["dial_step_size"], seed=1
+       )
+
+    The participant starts rotating after a normally distributed idle reaction time
+    (`idle_reaction_time` ± `idle_reaction_time_sd` s), picks the rotation key from the
+    remembered target orientation plus normally distributed noise
+    (± `orientation_sd` degrees) and releases after the number of frames that
+    turns the dial to that orientation. Break screens are pressed through after
+    `break_time` s. In both practice parts, Q is pressed after `practice_rounds` responses.
+    """
+
+    def __init__(
+        self,
+        window: VirtualWindow,
+        dial_step_size,
+        idle_reaction_time=0.6,
+        idle_reaction_time_sd=0.15,
+        orientation_sd=10,
+        break_time=1.0,
+        practice_rounds=0,
+        seed=None,
+    ):
+        super().__init__(window, practice_rounds=practice_rounds)
+        self.degrees_per_frame = degrees(dial_step_size)
+        self.idle_reaction_time = idle_reaction_time
+        self.idle_reaction_time_sd = idle_reaction_time_sd
+        self.orientation_sd = orientation_sd
+        self.break_time = break_time
+        self.rng = random.Random(seed)
+
+        self.bars = {}
+        self.cue_colour = None
+        self.turns_to_make = 0
+        window.on_flip.append(self.watch)
+
+    def watch(self, window: VirtualWindow):
+        # Remember the orientation of every bar seen, by colour
+        bars = [stimulus for stimulus in window.on_screen if isinstance(stimulus, Rect)]
+        if bars:
+            self.bars = {as_key(bar.fillColor): bar.ori for bar in bars}
+
+        # The probe cue (and the dial) are the only open circles
+        for stimulus in window.on_screen:
+            if isinstance(stimulus, Circle) and stimulus.fillColor is None:
+                self.cue_colour = as_key(stimulus.lineColor)
+
+    def get_target_orientation(self):
+        if self.cue_colour in self.bars:
+            return self.bars[self.cue_colour]
+
+        # Practising the dial, only one bar to look at
+        return next(iter(self.bars.values()), 0)
+
+    def choose_key(self, key_list):
+        if self.is_done_practising(key_list):
+            return "q"
+
+        if "m" not in key_list:
+            return key_list[0]
+
+        report = self.get_target_orientation() + self.rng.gauss(0, self.orientation_sd)
+        self.turns_to_make = max(1, round(abs(report) / self.degrees_per_frame))
+
+        return "m" if report > 0 else "z"
+
+    def get_reaction_time(self, key_list):
+        if "m" not in key_list:
+            return self.break_time
+
+        return max(
+            0.1, self.rng.gauss(self.idle_reaction_time, self.idle_reaction_time_sd)
+        )
+
+    def get_hold_frames(self, key):
+        if key in ["z", "m"]:
+            return self.turns_to_make
+
+        return self.hold_frames
@@ -0,0 +1,559 @@
+"""
+This file contains the functions necessary for
+testing the eyetracker code without an eyetracker.
+It stands in for the pylink module: its EyeLink produces gaze, pupil size,
+blinks and saccades at 500 or 1000 Hz, sends them over a link with some latency,
+records every message and command it gets and writes the recording as the
+.asc file that edf2asc would make of the .edf (see edfconvert.py).
+Install it before eyetracker.py or lib/eyelinker.py is imported:
+
+    import simulated_tracker
+    simulated_tracker.install()
+
+Or run `python simulated_tracker.py` to measure the throughput and latency
+of the eyetracker code on the simulated tracker (this needs a window).
+To run the 'unpredictable flickering null-cue experiment', see main.py.
+
+made by Anna van Harmelen, 2024
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import deque
+import numpy as np
+
+# Same values as in pylink
+SAMPLE_TYPE = 200
+STARTBLINK, ENDBLINK, STARTSACC, ENDSACC, STARTFIX, ENDFIX = 3, 4, 5, 6, 7, 8
+MISSING_DATA = -32768
+LEFT_EYE, RIGHT_EYE, BINOCULAR = 0, 1, 2
+
+CONSTANTS = dict(
+    SAMPLE_TYPE=SAMPLE_TYPE,
+    STARTBLINK=STARTBLINK,
+    ENDBLINK=ENDBLINK,
+    STARTSACC=STARTSACC,
+    ENDSACC=ENDSACC,
+    STARTFIX=STARTFIX,
+    ENDFIX=ENDFIX,
+    MISSING_DATA=MISSING_DATA,
+    LEFT_EYE=LEFT_EYE,
+    RIGHT_EYE=RIGHT_EYE,
+    BINOCULAR=BINOCULAR,
+    CAL_TARG_BEEP=1,
+    CAL_GOOD_BEEP=0,
+    CAL_ERR_BEEP=-1,
+    DC_TARG_BEEP=3,
+    DC_GOOD_BEEP=2,
+    DC_ERR_BEEP=-2,
+    CR_HAIR_COLOR=1,
+    PUPIL_HAIR_COLOR=2,
+    PUPIL_BOX_COLOR=3,
+    SEARCH_LIMIT_BOX_COLOR=4,
+    MOUSE_CURSOR_COLOR=5,
+    **{f"F{number}_KEY": 0x3A00 + number * 0x100 for number in range(1, 11)},
+    PAGE_UP=0x4900,
+    PAGE_DOWN=0x5100,
+    CURS_UP=0x4800,
+    CURS_DOWN=0x5000,
+    CURS_LEFT=0x4B00,
+    CURS_RIGHT=0x4D00,
+    ENTER_KEY=13,
+    ESC_KEY=27,
+    JUNK_KEY=1,
+)
+
+SACCADES_PER_SECOND = 2
+BLINKS_PER_SECOND = 0.25
+CAMERA_SIZE = (192, 160)  # in pixels, as sent by the tracker during set-up
+
+
+class SampleData:
+    def __init__(self, gaze, pupil_size) -> None:
+        self.gaze = gaze
+        self.pupil_size = pupil_size
+
+    def getGaze(self):
+        return self.gaze
+
+    def getPupilSize(self):
+        return self.pupil_size
+
+
+class Sample:
+    def __init__(self, time, eye, eye_data: SampleData) -> None:
+        self.time = time
+        self.eye = eye
+        self.eye_data = eye_data
+
+    def getTime(self):
+        return self.time
+
+    def isLeftSample(self):
+        return self.eye == LEFT_EYE
+
+    def isRightSample(self):
+        return self.eye == RIGHT_EYE
+
+    def getLeftEye(self):
+        return self.eye_data if self.eye == LEFT_EYE else None
+
+    def getRightEye(self):
+        return self.eye_data if self.eye == RIGHT_EYE else None
+
+
+class EndEvent:
+    """Stands in for the pylink end of saccade, blink and fixation events."""
+
+    def __init__(self, eye, start, end, start_gaze, end_gaze, pixels_per_degree):
+        self.eye = eye
+        self.start = start
+        self.end = end
+        self.start_gaze = start_gaze
+        self.end_gaze = end_gaze
+        self.pixels_per_degree = (pixels_per_degree, pixels_per_degree)
+
+    def getEye(self):
+        return self.eye
+
+    def getStartTime(self):
+        return self.start
+
+    def getEndTime(self):
+        return self.end
+
+    def getStartGaze(self):
+        return self.start_gaze
+
+    def getEndGaze(self):
+        return self.end_gaze
+
+    def getStartPPD(self):
+        return self.pixels_per_degree
+
+    def getEndPPD(self):
+        return self.pixels_per_degree
+
+
+class KeyInput:
+    def __init__(self, key, modifier=0) -> None:
+        self.key = key
+        self.modifier = modifier
+
+
+class EyeLinkCustomDisplay:
+    """The parts of pylink.EyeLinkCustomDisplay that PsychoPyCustomDisplay relies on."""
+
+    def __init__(self) -> None:
+        pass
+
+    def draw_cross_hair(self):
+        # The crosshair and pupil box as drawn on the camera image by the tracker
+        width, height = CAMERA_SIZE
+        self.draw_line(width // 2 - 10, height // 2, width // 2 + 10, height // 2, 1)
+        self.draw_line(width // 2, height // 2 - 10, width // 2, height // 2 + 10, 1)
+        self.draw_line(width // 2 - 30, height // 2, width // 2 - 20, height // 2, 2)
+        self.draw_line(width // 2 + 20, height // 2, width // 2 + 30, height // 2, 2)
+        self.draw_lozenge(width // 2 - 15, height // 2 - 15, 30, 30, 3)
+
+
+class SimulatedEyeLink:
+    """
+    Stands in for a pylink.EyeLink, tracking one `eye` at `sample_rate` Hz.
+
+    Gaze is generated in real time (or on `clock`, e.g. a virtual clock) whenever
+    the tracker is asked for something: it fixates around the centre of the screen,
+    makes about SACCADES_PER_SECOND saccades (sometimes to where the bars are)
+    and blinks about BLINKS_PER_SECOND. Samples and events arrive over the link
+    `link_latency` (+ up to `link_jitter`) seconds after they happened.
+
+    Every message is kept in `messages` as (time sent, time received, text) in
+    tracker time (ms), every command in `commands`.
+    """
+
+    def __init__(
+        self,
+        sample_rate=1000,
+        link_latency=0.002,
+        link_jitter=0.001,
+        eye="RIGHT",
+        pixels_per_degree=44,
+        clock=time.perf_counter,
+        seed=None,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.link_latency = link_latency * 1000
+        self.link_jitter = link_jitter * 1000
+        self.eye = RIGHT_EYE if eye == "RIGHT" else LEFT_EYE
+        self.pixels_per_degree = pixels_per_degree
+        self.clock = clock
+        self.start_time = clock()
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.RLock()
+
+        self.screen_size = (1920, 1080)
+        self.recording = False
+        self.link = deque(maxlen=65536)  # the oldest data is lost when it's full
+        self.newest_sample = None
+        self.current_data = None
+        self.messages = []
+        self.commands = []
+
+        self.data_file = None
+        self.data_file_name = None
+
+        # Gaze starts fixating the centre
+        self.next_sample_time = float(np.ceil(self.trackerTime()))
+        self.fixation = (self.screen_size[0] / 2, self.screen_size[1] / 2)
+        self.fixation_start = self.next_sample_time
+        self.saccade = None
+        self.blink = None
+
+    def trackerTime(self):
+        # Like the tracker's own clock, in ms since it booted
+        return round(1_000_000 + (self.clock() - self.start_time) * 1000, 3)
+
+    def _arrival(self, time):
+        return time + self.link_latency + self.rng.uniform(0, self.link_jitter)
+
+    def _write(self, line):
+        if self.data_file and not self.data_file.closed:
+            self.data_file.write(line + "\n")
+
+    def _send_event(self, data_type, event, line):
+        if self.recording:
+            self.link.append((self._arrival(event.end), data_type, event))
+            self._write(line)
+
+    def _next_gaze(self, time):
+        """Moves the simulated eye on to `time` and returns its gaze and pupil size."""
+        eye = "R" if self.eye == RIGHT_EYE else "L"
+        ppd = self.pixels_per_degree
+
+        if self.blink:
+            if time < self.blink:
+                return (MISSING_DATA, MISSING_DATA), 0.0
+
+            self._send_event(
+                ENDBLINK,
+                EndEvent(self.eye, self.blink_start, time, None, None, ppd),
+                f"EBLINK {eye} {self.blink_start:.0f}\t{time:.0f}\t{time - self.blink_start:.0f}",
+            )
+            self.blink = None
+
+        if self.saccade:
+            start, end, start_gaze, end_gaze = self.saccade
+            if time < end:
+                progress = (time - start) / (end - start)
+                return (
+                    start_gaze[0] + progress * (end_gaze[0] - start_gaze[0]),
+                    start_gaze[1] + progress * (end_gaze[1] - start_gaze[1]),
+                ), 1000.0
+
+            amplitude = np.hypot(*np.subtract(end_gaze, start_gaze)) / ppd
+            self._send_event(
+                ENDSACC,
+                EndEvent(self.eye, start, time, start_gaze, end_gaze, ppd),
+                f"ESACC {eye}\t{start:.0f}\t{time:.0f}\t{time - start:.0f}\t"
+                f"{start_gaze[0]:.1f}\t{start_gaze[1]:.1f}\t{end_gaze[0]:.1f}\t"
+                f"{end_gaze[1]:.1f}\t{amplitude:.2f}\t{30 * amplitude + 100:.0f}",
+            )
+            self.saccade = None
+            self.fixation = end_gaze
+            self.fixation_start = time
+
+        if self.rng.random() < SACCADES_PER_SECOND / self.sample_rate:
+            # Mostly small saccades around the centre, now and then to a bar
+            centre = np.array(self.screen_size) / 2
+            target = centre + self.rng.normal(0, 0.5 * ppd, 2)
+            if self.rng.random() < 0.1:
+                target[0] += self.rng.choice([-6, 6]) * ppd
+
+            self._send_event(
+                ENDFIX,
+                EndEvent(
+                    self.eye,
+                    self.fixation_start,
+                    time,
+                    self.fixation,
+                    self.fixation,
+                    ppd,
+                ),
+                f"EFIX {eye}\t{self.fixation_start:.0f}\t{time:.0f}\t"
+                f"{time - self.fixation_start:.0f}\t{self.fixation[0]:.1f}\t"
+                f"{self.fixation[1]:.1f}\t1000",
+            )
+
+            # Saccades last longer the larger they are
+            amplitude = np.hypot(*(target - self.fixation)) / ppd
+            self.saccade = (
+                time,
+                time + 21 + 2.2 * amplitude,
+                self.fixation,
+                tuple(target),
+            )
+
+        elif self.rng.random() < BLINKS_PER_SECOND / self.sample_rate:
+            self.blink_start = time
+            self.blink = time + self.rng.uniform(80, 200)
+
+        return tuple(
+            self.fixation + self.rng.normal(0, 0.3, 2)
+        ), 1000.0 + self.rng.normal(0, 5)
+
+    def _advance(self):
+        """Generates all samples (and events) up to now."""
+        with self.lock:
+            return self._generate_until(self.trackerTime())
+
+    def _generate_until(self, now):
+        while self.next_sample_time <= now:
+            time = self.next_sample_time
+            gaze, pupil_size = self._next_gaze(time)
+
+            if self.recording:
+                sample = Sample(time, self.eye, SampleData(gaze, pupil_size))
+                self.link.append((self._arrival(time), SAMPLE_TYPE, sample))
+                self.newest_sample = sample
+
+                values = "\t".join(
+                    "." if value == MISSING_DATA else f"{value:.1f}"
+                    for value in (*gaze, pupil_size)
+                )
+                self._write(f"{time:.0f}\t{values}\t...")
+
+            self.next_sample_time += 1000 / self.sample_rate
+
+        return now
+
+    # The link
+    def getNextData(self):
+        now = self._advance()
+
+        # Only what has arrived by now, in the order it arrives
+        if self.link and self.link[0][0] <= now:
+            _, data_type, self.current_data = self.link.popleft()
+            return data_type
+
+        return 0
+
+    def getFloatData(self):
+        return self.current_data
+
+    def getNewestSample(self):
+        self._advance()
+        return self.newest_sample
+
+    def eyeAvailable(self):
+        return self.eye
+
+    def isConnected(self):
+        return True
+
+    # Messages and commands
+    def sendMessage(self, text):
+        with self.lock:
+            sent = self.trackerTime()
+            received = self._arrival(sent)
+            self.messages.append((sent, received, text))
+            self._write(f"MSG\t{received:.0f} {text}")
+
+    def sendCommand(self, command):
+        self.commands.append(command)
+
+        name, _, value = command.partition("=")
+        if name.strip() == "screen_pixel_coords":
+            left, top, right, bottom = (float(number) for number in value.split())
+            self.screen_size = (right - left, bottom - top)
+            self.fixation = (self.screen_size[0] / 2, self.screen_size[1] / 2)
+        elif name.strip() == "sample_rate":
+            self.sample_rate = int(value)
+
+    # Recording
+    def startRecording(self, *args):
+        self._advance()
+        self.recording = True
+
+        eye = "RIGHT" if self.eye == RIGHT_EYE else "LEFT"
+        self._write(f"START\t{self.trackerTime():.0f} \t{eye}\tSAMPLES\tEVENTS")
+        self._write(
+            f"SAMPLES\tGAZE\t{eye}\tRATE\t{self.sample_rate:.2f}\tTRACKING\tCR\tFILTER\t2"
+        )
+        return 0
+
+    def stopRecording(self):
+        self._advance()
+        self.recording = False
+        self._write(f"END\t{self.trackerTime():.0f} \tSAMPLES\tEVENTS")
+
+    def setOfflineMode(self):
+        self._advance()
+        self.recording = False
+
+    def openDataFile(self, name):
+        self.data_file_name = name
+        self.data_file = tempfile.NamedTemporaryFile(
+            "w", suffix=".asc", delete=False, encoding="latin-1"
+        )
+        self._write(f"** CONVERTED FROM {name} (simulated tracker)")
+        return 0
+
+    def closeDataFile(self):
+        if self.data_file:
+            self._advance()
+            self.data_file.close()
+
+    def receiveDataFile(self, name, new_name):
+        """Saves the recording as the .asc that edf2asc would make of `new_name`."""
+        self.closeDataFile()
+        asc_name = os.path.splitext(new_name)[0] + ".asc"
+        shutil.copyfile(self.data_file.name, asc_name)
+        return os.path.getsize(asc_name)
+
+    def close(self):
+        self.closeDataFile()
+        if self.data_file:
+            os.remove(self.data_file.name)
+            self.data_file = None
+
+    # Set-up and calibration
+    def doTrackerSetup(self, width=None, height=None):
+        """Shows some camera images and calibration targets on the display set with openGraphicsEx."""
+        display = _graphics["display"]
+        if display is None:
+            return
+
+        display.setup_cal_display()
+
+        # A dark pupil on a lighter eye, with some noise
+        camera_width, camera_height = CAMERA_SIZE
+        display.setup_image_display(camera_width, camera_height)
+        display.set_image_palette(*[list(range(0, 256, 4))] * 3)
+        y, x = np.mgrid[:camera_height, :camera_width]
+        pupil = np.hypot(x - camera_width / 2, y - camera_height / 2) < 20
+
+        for _ in range(30):
+            image = np.where(pupil, 2, 40) + self.rng.integers(0, 8, pupil.shape)
+            display.image_title("Simulated camera")
+            for line in range(camera_height):
+                display.draw_image_line(
+                    camera_width, line + 1, camera_height, image[line]
+                )
+        display.exit_image_display()
+
+        # Nine-point calibration
+        for x in [0.25, 0.5, 0.75]:
+            for y in [0.25, 0.5, 0.75]:
+                display.draw_cal_target(
+                    x * self.screen_size[0], y * self.screen_size[1]
+                )
+                display.erase_cal_target()
+        display.exit_cal_display()
+
+    def doDriftCorrect(self, x, y, draw=1, allow_setup=1):
+        return 0
+
+    def applyDriftCorrect(self):
+        return 0
+
+    # Everything else is accepted and ignored
+    def __getattr__(self, name):
+        if name.startswith("set"):
+            return lambda *args, **kwargs: None
+        raise AttributeError(name)
+
+
+_graphics = {"display": None, "tracker": None}
+
+
+def install(**options):
+    """
+    Register a module standing in for pylink, so every `import pylink` after this
+    gets simulated trackers made with `options` (see SimulatedEyeLink).
+    Returns the module.
+    """
+
+    def EyeLink(*args):
+        _graphics["tracker"] = SimulatedEyeLink(**options)
+        return _graphics["tracker"]
+
+    def openGraphicsEx(display):
+        _graphics["display"] = display
+
+    def closeGraphics():
+        _graphics["display"] = None
+
+    pylink = types.ModuleType("pylink")
+    pylink.__dict__.update(
+        CONSTANTS,
+        EyeLink=EyeLink,
+        EyeLinkCustomDisplay=EyeLinkCustomDisplay,
+        KeyInput=KeyInput,
+        openGraphicsEx=openGraphicsEx,
+        closeGraphics=closeGraphics,
+        getEYELINK=lambda: _graphics["tracker"],
+        msecDelay=lambda ms: time.sleep(ms / 1000),
+        flushGetkeyQueue=lambda: None,
+        setCalibrationColors=lambda *args: None,
+        setCalibrationSounds=lambda *args: None,
+    )
+    sys.modules["pylink"] = pylink
+
+    return pylink
+
+
+def measure(duration=10, sample_rate=1000, directory=None):
+    """
+    Record `duration` s on a simulated tracker through eyetracker.Eyelinker,
+    sending a trigger on every flip, and print how the eyetracker code kept up.
+    """
+    install(sample_rate=sample_rate)
+
+    from psychopy import visual
+    from eyetracker import Eyelinker
+    from edfconvert import convert_recording
+
+    directory = directory or tempfile.mkdtemp()
+    window = visual.Window(size=(800, 600), units="pix", color="#7F7F7F")
+    eyelinker = Eyelinker(0, 0, window, directory)
+    eyelinker.tracker.setup_tracker()
+    eyelinker.start()
+
+    simulated = eyelinker.tracker.tracker
+    n_flips = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        eyelinker.send_trigger(215, window.flip())
+        n_flips += 1
+    n_samples = eyelinker.tracker.samples.n_written
+    n_saccades = eyelinker.tracker.saccades.n_saccades
+
+    eyelinker.stop()
+    window.close()
+
+    delays = [received - sent for sent, received, _ in simulated.messages]
+    log = eyelinker.dispatcher.log
+    print(
+        f"{n_flips} triggers in {duration} s, {len(simulated.messages)} messages received"
+    )
+    print(f"median link delay of messages: {np.median(delays):.2f} ms")
+    print(
+        f"median flip to send: {np.median([row[2] for row in log]):.0f} ms, "
+        f"median send duration: {np.median([row[3] for row in log]):.3f} ms"
+    )
+    print(
+        f"{n_samples} samples ({n_samples / duration:.0f} Hz) and "
+        f"{n_saccades} saccades buffered"
+    )
+    print(
+        f"recording converted to {convert_recording(os.path.join(directory, '0_0.asc'))}"
+    )
+
+
+if __name__ == "__main__":
+    measure()
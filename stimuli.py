@@ -6,7 +6,7 @@ To run the 'unpredictable flickering null-cue experiment', see main.py.
 made by Anna van Harmelen, 2024
 """
 
-from psychopy import visual
+from time import perf_counter
 
 ECCENTRICITY = 6
 DOT_SIZE = 0.1  # radius of inner circle
@@ -15,35 +15,76 @@ BAR_SIZE = [0.7, 4]  # width, height
 PROBE_CUE_SIZE = 2  # radius of circle (same as response dial size)
 
 
-decentral_dot = fixation_dot = None
+# Every shape is only built once per window, after that it is updated in place
+_pools = {}
 
 
-def create_fixation_dot(settings):
-    global decentral_dot, fixation_dot
+def get_pooled(name, settings, make_stimulus):
+    pool = _pools.setdefault(settings["window"], {})
+
+    if name not in pool:
+        pool[name] = make_stimulus()
+
+    return pool[name]
+
+
+# What every pooled stimulus was last set to, as psychopy gives its settings back
+# in other units (e.g. colours as rgb instead of the hex we set)
+_applied = {}
+
 
+def update_stimulus(stimulus, **settings):
+    # Setting e.g. ori or fillColor recomputes the shape, so only set what changed
+    applied = _applied.setdefault(stimulus, {})
+
+    for name, value in settings.items():
+        if applied.get(name) != value:
+            setattr(stimulus, name, value)
+            applied[name] = value
+
+
+def create_fixation_dot(settings):
     # Make fixation dot
-    if decentral_dot is None:
-        decentral_dot = visual.Circle(
+    decentral_dot = get_pooled(
+        "decentral_dot",
+        settings,
+        lambda: settings["visual"].Circle(
             win=settings["window"],
             units="pix",
             radius=settings["deg2pix"](TOTAL_DOT_SIZE),
             pos=(0, 0),
             fillColor="#eaeaea",
-        )
+        ),
+    )
 
-    if fixation_dot is None:
-        fixation_dot = visual.Circle(
+    fixation_dot = get_pooled(
+        "fixation_dot",
+        settings,
+        lambda: settings["visual"].Circle(
             win=settings["window"],
             units="pix",
             radius=settings["deg2pix"](DOT_SIZE),
             pos=(0, 0),
             fillColor="#000000",
-        )
+        ),
+    )
 
     decentral_dot.draw()
     fixation_dot.draw()
 
 
+def build_bar(orientation, colour, pos, settings):
+    return settings["visual"].Rect(
+        win=settings["window"],
+        units="pix",
+        width=settings["deg2pix"](BAR_SIZE[0]),
+        height=settings["deg2pix"](BAR_SIZE[1]),
+        pos=pos,
+        ori=orientation,
+        fillColor=colour,
+    )
+
+
 def make_one_bar(orientation, colour, position, settings):
     # Check input
     if position == "left":
@@ -55,16 +96,13 @@ def make_one_bar(orientation, colour, position, settings):
     else:
         raise Exception(f"Expected 'left' or 'right', but received {position!r}. :(")
 
-    # Create bar stimulus
-    bar_stimulus = visual.Rect(
-        win=settings["window"],
-        units="pix",
-        width=settings["deg2pix"](BAR_SIZE[0]),
-        height=settings["deg2pix"](BAR_SIZE[1]),
-        pos=pos,
-        ori=orientation,
-        fillColor=colour,
+    # Get bar stimulus and update it for this trial
+    bar_stimulus = get_pooled(
+        f"{position}_bar",
+        settings,
+        lambda: build_bar(orientation, colour, pos, settings),
     )
+    update_stimulus(bar_stimulus, ori=orientation, fillColor=colour)
 
     return bar_stimulus
 
@@ -76,35 +114,77 @@ def create_stimuli_frame(left_orientation, right_orientation, colours, settings)
 
 
 def create_capture_cue_frame(colour, settings):
-    decentral_dot = visual.Circle(
-        win=settings["window"],
-        units="pix",
-        radius=settings["deg2pix"](TOTAL_DOT_SIZE),
-        pos=(0, 0),
-        fillColor=colour,
+    decentral_dot = get_pooled(
+        "capture_cue_outside",
+        settings,
+        lambda: settings["visual"].Circle(
+            win=settings["window"],
+            units="pix",
+            radius=settings["deg2pix"](TOTAL_DOT_SIZE),
+            pos=(0, 0),
+            fillColor=colour,
+        ),
     )
+    decentral_dot.fillColor = colour
 
-    fixation_dot = visual.Circle(
-        win=settings["window"],
-        units="pix",
-        radius=settings["deg2pix"](DOT_SIZE),
-        pos=(0, 0),
-        fillColor="#000000",
+    fixation_dot = get_pooled(
+        "capture_cue_inside",
+        settings,
+        lambda: settings["visual"].Circle(
+            win=settings["window"],
+            units="pix",
+            radius=settings["deg2pix"](DOT_SIZE),
+            pos=(0, 0),
+            fillColor="#000000",
+        ),
     )
 
     return decentral_dot, fixation_dot
 
 
 def create_probe_cue(colour, settings):
-    probe = visual.Circle(
-        win=settings["window"],
-        radius=settings["deg2pix"](PROBE_CUE_SIZE),
-        edges=settings["deg2pix"](1),
-        pos=(0, 0),
-        lineWidth=settings["deg2pix"](0.1),
-        fillColor=None,
-        lineColor=colour,
+    probe = get_pooled(
+        "probe_cue",
+        settings,
+        lambda: settings["visual"].Circle(
+            win=settings["window"],
+            radius=settings["deg2pix"](PROBE_CUE_SIZE),
+            edges=settings["deg2pix"](1),
+            pos=(0, 0),
+            lineWidth=settings["deg2pix"](0.1),
+            fillColor=None,
+            lineColor=colour,
+        ),
     )
+    probe.lineColor = colour
     probe.draw()
 
     create_fixation_dot(settings)
+
+
+def time_pool_savings(settings, n_draws=100):
+    """
+    Compare drawing a bar that is built from scratch every time (as before pooling)
+    to drawing the pooled bar that is only updated. Returns the average time
+    per draw in ms for both, plus the time saved per draw.
+    """
+    colour = "#eaeaea"
+
+    start = perf_counter()
+    for i in range(n_draws):
+        build_bar(i % 90, colour, (0, 0), settings).draw()
+    fresh = (perf_counter() - start) / n_draws * 1000
+
+    start = perf_counter()
+    for i in range(n_draws):
+        make_one_bar(i % 90, colour, "middle", settings).draw()
+    pooled = (perf_counter() - start) / n_draws * 1000
+
+    # Don't leave any of these test bars on the screen
+    settings["window"].clearBuffer()
+
+    return {
+        "fresh_draw_in_ms": round(fresh, 3),
+        "pooled_draw_in_ms": round(pooled, 3),
+        "saved_per_draw_in_ms": round(fresh - pooled, 3),
+    }
@@ -0,0 +1,39 @@
+"""
+This file contains the tests of a headless session (see virtual.py),
+run them with `python -m pytest`.
+To run the 'unpredictable flickering null-cue experiment', see main.py.
+
+made by Anna van Harmelen, 2024
+"""
+
+import os
+import subprocess
+import sys
+import pandas as pd
+
+# Run in a fresh interpreter in which the lab stack can't be imported,
+# also where it's installed
+HEADLESS_SESSION = """
+import sys
+for module in ["psychopy", "pylink", "pygame"]:
+    sys.modules[module] = None
+
+import main
+main.N_BLOCKS = 6
+main.main(headless=True, directory=sys.argv[1])
+"""
+
+
+def test_headless_session_without_lab_stack(tmp_path):
+    subprocess.run(
+        [sys.executable, "-c", HEADLESS_SESSION, str(tmp_path)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        check=True,
+    )
+
+    trials = pd.read_csv(tmp_path / "data_session_1.csv")
+    participants = pd.read_csv(tmp_path / "participantinfo.csv")
+
+    assert len(trials) == 6 * 36
+    assert trials["dropped_frames"].sum() == 0
+    assert participants["trials_completed"].tolist() == [len(trials)]
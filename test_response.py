@@ -0,0 +1,55 @@
+"""
+This file contains the tests of the response timing in response.py,
+run them with `python -m pytest`.
+To run the 'unpredictable flickering null-cue experiment', see main.py.
+
+made by Anna van Harmelen, 2024
+"""
+
+from types import SimpleNamespace
+import pytest
+from set_up import get_settings
+from response import get_response
+from virtual import VirtualKeyboard
+
+MONITOR = {"resolution": (1920, 1080), "Hz": 60, "width": 33, "distance": 50}
+
+
+def respond(flip_clock_epoch, keyboard_clock_epoch, reaction_time, hold_frames):
+    settings = get_settings(MONITOR, None, headless=True, timestamped_response=True)
+    settings["flip_clock"].epoch = flip_clock_epoch
+
+    keyboard = settings["keyboard"] = VirtualKeyboard(
+        settings["window"], reaction_time, hold_frames
+    )
+    keyboard.clock = SimpleNamespace(getLastResetTime=lambda: keyboard_clock_epoch)
+    keyboard.practice_parts_left = 0  # respond instead of pressing Q
+
+    probe_onset = settings["window"].flip()
+
+    return get_response(
+        target_orientation=30,
+        target_colour="#000000",
+        settings=settings,
+        testing=True,
+        eyetracker=None,
+        predictability="predictable",
+        cue_timing="early",
+        trial_condition="congruent",
+        flicker_type="stable",
+        target_bar="left",
+        probe_onset=probe_onset,
+    )
+
+
+@pytest.mark.parametrize(
+    "flip_clock_epoch, keyboard_clock_epoch", [(0, 0), (1000, 250), (250, 1000)]
+)
+def test_timestamped_response_with_different_clock_epochs(
+    flip_clock_epoch, keyboard_clock_epoch
+):
+    report = respond(flip_clock_epoch, keyboard_clock_epoch, 0.3, 30)
+
+    assert report["timestamped_response"]
+    assert report["idle_reaction_time_in_ms"] == pytest.approx(300, abs=0.01)
+    assert report["response_time_in_ms"] == pytest.approx(500, abs=0.01)
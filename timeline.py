@@ -0,0 +1,75 @@
+"""
+This file contains the functions necessary for
+showing a sequence of screens for an exact number of frames each.
+To run the 'unpredictable flickering null-cue experiment', see main.py.
+
+made by Anna van Harmelen, 2024
+"""
+
+from fliplog import flip
+
+
+def to_frames(duration, refresh_rate):
+    """
+    Convert a duration in seconds to the nearest whole number of frames,
+    rounding halves up (round() would round them to even, so in either direction).
+    """
+    return max(1, int(duration * refresh_rate + 0.5))
+
+
+def get_planned_time(screens, first, last, refresh_rate):
+    """
+    Return the time in seconds from the onset of screen `first` to that of screen
+    `last` in `screens` as the timeline plans it, so in whole frames.
+    """
+    names = [name for name, _, _ in screens]
+
+    return (
+        sum(
+            to_frames(duration, refresh_rate)
+            for _, duration, _ in screens[names.index(first) : names.index(last)]
+        )
+        / refresh_rate
+    )
+
+
+def run_timeline(screens, settings, on_onset=None):
+    """
+    Show every screen in `screens` for an exact number of frames by counting flips,
+    at the refresh rate measured in `get_settings`.
+
+    `screens` is a list of (name, duration, draw) tuples, where `draw` gets the
+    index of the frame within that screen and draws it. A duration of None
+    means the screen is drawn and flipped once, and then stays on screen.
+    `on_onset(name, flip_time)` is called right after the first flip of each screen.
+
+    Returns the flip time of the first frame of each screen, and for each screen
+    followed by another one, by how many frames it overshot its duration.
+    """
+    refresh_rate = settings["refresh_rate"]
+
+    onsets = {}
+    planned_frames = {}
+
+    for name, duration, draw in screens:
+        n_frames = 1 if duration is None else to_frames(duration, refresh_rate)
+        planned_frames[name] = n_frames
+
+        for frame in range(n_frames):
+            draw(frame)
+            flip_time = flip(settings, name)
+
+            if frame == 0:
+                onsets[name] = flip_time
+
+                if on_onset:
+                    on_onset(name, flip_time)
+
+    names = [name for name, _, _ in screens]
+    overshoots = {
+        name: round((onsets[next_name] - onsets[name]) * refresh_rate, 2)
+        - planned_frames[name]
+        for name, next_name in zip(names, names[1:])
+    }
+
+    return onsets, overshoots
@@ -7,9 +7,6 @@ To run the 'unpredictable flickering null-cue experiment', see main.py.
 made by Anna van Harmelen, 2024
 """
 
-from psychopy import visual
-from psychopy.core import wait
-from time import time, sleep
 from response import get_response
 from stimuli import (
     create_fixation_dot,
@@ -18,6 +15,11 @@ from stimuli import (
     create_probe_cue,
 )
 from eyetracker import get_trigger
+from timeline import get_planned_time, run_timeline, to_frames
+from flicker import get_flicker_schedule, get_realized_frequency
+from fliplog import flip
+from fixation import MONITORED_SCREENS
+from collections import OrderedDict
 import random
 
 # experiment flow:
@@ -34,17 +36,58 @@ COLOURS = [
     [(rgb_value / 128 - 1) for rgb_value in rgb_triplet] for rgb_triplet in COLOURS
 ]
 
+TEXT_HEIGHT = 22
+TEXT_CACHE_SIZE = 256
+_text_cache = OrderedDict()
 
-def generate_stimuli_characteristics(
-    condition, target_bar, flicker_type, cue_timing, predictability
-):
-    stimuli_colours = random.sample(COLOURS, 2)
+# Screens of which the onset is marked with a trigger
+TRIGGER_SCREENS = ["stimuli_onset", "capture_cue_onset", "probe_cue_onset"]
+
+
+def draw_stimuli(rng=random):
+    """
+    Draw the random parts of a single trial: the indices of the two
+    bar colours in COLOURS, the two bar orientations and the ITI in ms.
+    """
+    colour_indices = rng.sample(range(len(COLOURS)), 2)
 
     orientations = [
-        random.choice([-1, 1]) * random.randint(5, 85),
-        random.choice([-1, 1]) * random.randint(5, 85),
+        rng.choice([-1, 1]) * rng.randint(5, 85),
+        rng.choice([-1, 1]) * rng.randint(5, 85),
     ]
 
+    return colour_indices, orientations, rng.randint(500, 800)
+
+
+def generate_stimuli_characteristics(
+    condition, target_bar, flicker_type, cue_timing, predictability, rng=random
+):
+    colour_indices, orientations, iti = draw_stimuli(rng)
+
+    return derive_stimuli_characteristics(
+        condition,
+        target_bar,
+        flicker_type,
+        cue_timing,
+        predictability,
+        iti,
+        colour_indices,
+        orientations,
+    )
+
+
+def derive_stimuli_characteristics(
+    condition,
+    target_bar,
+    flicker_type,
+    cue_timing,
+    predictability,
+    iti,
+    colour_indices,
+    orientations,
+):
+    stimuli_colours = [COLOURS[index] for index in colour_indices]
+
     if target_bar == "left":
         target_colour, distractor_colour = stimuli_colours
         target_orientation = orientations[0]
@@ -66,7 +109,7 @@ def generate_stimuli_characteristics(
 
     return {
         "predictability": predictability,
-        "ITI": random.randint(500, 800) / 1000,
+        "ITI": iti / 1000,
         "stimuli_colours": stimuli_colours,
         "flicker_type": flicker_type,
         "cue_delay": cue_delay,
@@ -81,17 +124,6 @@ def generate_stimuli_characteristics(
     }
 
 
-def do_while_showing(waiting_time, something_to_do, window):
-    """
-    Show whatever is drawn to the screen for exactly `waiting_time` period,
-    while doing `something_to_do` in the mean time.
-    """
-    window.flip()
-    start = time()
-    something_to_do()
-    wait(waiting_time - (time() - start))
-
-
 def single_trial(
     predictability,
     ITI,
@@ -112,96 +144,85 @@ def single_trial(
 ):
     # Set parameters
     colour_list = [capture_colour, "#eaeaea"]
-    cue_colour = colour_list[0]
     cue_duration = 1.00
 
     # Create capture cue already, so it doesn't have to made later during the trial
-    outside, inside = create_capture_cue_frame(cue_colour, settings)
+    outside, inside = create_capture_cue_frame(colour_list[0], settings)
 
-    # Initial fixation cross to eliminate jitter caused by for loop
-    create_fixation_dot(settings)
+    # Get the precomputed colour of the capture cue on every frame
+    flicker = get_flicker_schedule(
+        flicker_type,
+        to_frames(cue_duration, settings["refresh_rate"]),
+        settings["refresh_rate"],
+    )
+
+    def draw_capture_cue(frame):
+        # Only switch fill colour on the frames where the flicker says so
+        if frame == 0 or flicker[frame] != flicker[frame - 1]:
+            outside.fillColor = colour_list[flicker[frame]]
+
+        outside.draw()
+        inside.draw()
 
     screens = [
-        (0, lambda: 0 / 0, None),  # initial one to make life easier
-        (ITI, lambda: create_fixation_dot(settings), None),
+        ("iti", ITI, lambda frame: create_fixation_dot(settings)),
         (
+            "stimuli_onset",
             0.25,
-            lambda: create_stimuli_frame(
+            lambda frame: create_stimuli_frame(
                 left_orientation, right_orientation, stimuli_colours, settings
             ),
-            "stimuli_onset",
         ),
-        (cue_delay, lambda: create_fixation_dot(settings), None),
-        (cue_duration, lambda: (outside.draw(), inside.draw()), "capture_cue_onset"),
-        (2.0 - cue_delay, lambda: create_fixation_dot(settings), None),
-        (None, lambda: create_probe_cue(target_colour, settings), None),
+        ("cue_delay", cue_delay, lambda frame: create_fixation_dot(settings)),
+        ("capture_cue_onset", cue_duration, draw_capture_cue),
+        ("probe_delay", 2.0 - cue_delay, lambda frame: create_fixation_dot(settings)),
+        (
+            "probe_cue_onset",
+            None,
+            lambda frame: create_probe_cue(target_colour, settings),
+        ),
     ]
 
-    # Set flicker delay in seconds
-    flicker_delay = {
-        "stable": cue_duration * 0.9,
-        "high_freq": 1 / (6 * 2),
-        "low_freq": 1 / (3 * 2),
-    }[flicker_type]
+    # Check fixation every frame from the stimuli up to the capture cue, if possible
+    fixation_monitor = settings.get("fixation_monitor")
+
+    def check_fixation(draw):
+        def draw_and_check(frame):
+            draw(frame)
+            fixation_monitor.check()
 
-    # !!! The timing you pass to do_while_showing is the timing for the screen that has already been drawn. !!!
-    for index, (duration, _, frame) in enumerate(screens[:-1]):
+        return draw_and_check
+
+    if fixation_monitor:
+        screens = [
+            (
+                name,
+                duration,
+                check_fixation(draw) if name in MONITORED_SCREENS else draw,
+            )
+            for name, duration, draw in screens
+        ]
+
+    def on_onset(name, flip_time):
+        if fixation_monitor and name == MONITORED_SCREENS[0]:
+            fixation_monitor.start()
+        elif fixation_monitor and name == "capture_cue_onset":
+            fixation_monitor.stop()
 
         # Send trigger if not testing
-        if not testing and frame:
+        if not testing and name in TRIGGER_SCREENS:
             trigger = get_trigger(
-                frame,
+                name,
                 predictability,
                 cue_timing,
                 trial_condition,
                 flicker_type,
                 target_bar,
             )
-            eyetracker.tracker.send_message(f"trig{trigger}")
-
-        if frame != "capture_cue_onset":
-            # Draw the next screen while showing the current one
-            do_while_showing(duration, screens[index + 1][1], settings["window"])
-        else:
-
-            # Turn on capture cue
-            settings["window"].flip()
-
-            # Time start of capture cue
-            flicker_start = start = time()
-
-            while (flicker_start - start) < (duration - flicker_delay):
-
-                # Switch between fill colours each iteration
-                outside.fillColor = cue_colour = colour_list[
-                    1 - colour_list.index(cue_colour)
-                ]
-
-                # Draw cue again
-                screens[index][1]()
-
-                # Wait appropriate amount of time and then immediately flip
-                wait(flicker_delay - (time() - flicker_start))
-                settings["window"].flip()
-                flicker_start += flicker_delay
-
-            # Quickly draw the next screen
-            screens[index + 1][1]()
-
-    # The for loop only draws the probe cue, never shows it
-    # So show it here
-    if not testing:
-        trigger = get_trigger(
-            "probe_cue_onset",
-            predictability,
-            cue_timing,
-            trial_condition,
-            flicker_type,
-            target_bar,
-        )
-        eyetracker.tracker.send_message(f"trig{trigger}")
+            eyetracker.send_trigger(trigger, flip_time)
 
-    settings["window"].flip()
+    # Show all screens up to and including the probe cue, frame by frame
+    onsets, overshoots = run_timeline(screens, settings, on_onset)
 
     response = get_response(
         target_orientation,
@@ -214,6 +235,7 @@ def single_trial(
         trial_condition,
         flicker_type,
         target_bar,
+        probe_onset=onsets["probe_cue_onset"],
     )
 
     if not testing:
@@ -225,13 +247,13 @@ def single_trial(
             flicker_type,
             target_bar,
         )
-        eyetracker.tracker.send_message(f"trig{trigger}")
+        eyetracker.send_trigger(trigger)
 
     # Show performance
     create_fixation_dot(settings)
-    show_text(
-        f"{response['performance']}", settings["window"], (0, settings["deg2pix"](0.7))
-    )
+    show_text(f"{response['performance']}", settings, (0, settings["deg2pix"](0.7)))
+
+    feedback_onset = flip(settings, "feedback")
 
     if not testing:
         trigger = get_trigger(
@@ -242,9 +264,27 @@ def single_trial(
             flicker_type,
             target_bar,
         )
-        eyetracker.tracker.send_message(f"trig{trigger}")
-    settings["window"].flip()
-    sleep(0.25)
+        eyetracker.send_trigger(trigger, feedback_onset)
+
+    settings["clock"].wait(0.25)
+
+    # Without a flip log (e.g. during practice), there are no flip times to go by
+    realized_flicker_frequency = None
+
+    if "flip_log" in settings:
+        realized_flicker_frequency = get_realized_frequency(
+            flicker, settings["flip_log"].get_flip_times("capture_cue_onset")
+        )
+        response.update(
+            settings["flip_log"].summarise(
+                get_planned_time(
+                    screens,
+                    "stimuli_onset",
+                    "capture_cue_onset",
+                    settings["refresh_rate"],
+                )
+            )
+        )
 
     return {
         "condition_code": get_trigger(
@@ -255,13 +295,44 @@ def single_trial(
             flicker_type,
             target_bar,
         ),
-        ** response,
+        "realized_flicker_frequency": realized_flicker_frequency,
+        "fixation_broken": fixation_monitor.broken if fixation_monitor else None,
+        **response,
+        **{
+            f"{name}_overshoot_in_frames": overshoot
+            for name, overshoot in overshoots.items()
+        },
     }
 
 
-def show_text(input, window, pos=(0, 0), colour="#ffffff"):
-    textstim = visual.TextStim(
-        win=window, font="Courier New", text=input, color=colour, pos=pos, height=22
-    )
+def get_text_stim(input, settings, pos=(0, 0), colour="#ffffff"):
+    # Laying out text is slow, so every text is only laid out once
+    key = (settings["window"], input, tuple(pos), colour, TEXT_HEIGHT)
+
+    if key in _text_cache:
+        _text_cache.move_to_end(key)
+    else:
+        _text_cache[key] = settings["visual"].TextStim(
+            win=settings["window"],
+            font="Courier New",
+            text=input,
+            color=colour,
+            pos=pos,
+            height=TEXT_HEIGHT,
+        )
+
+        # Forget the least recently shown text if the cache is full
+        if len(_text_cache) > TEXT_CACHE_SIZE:
+            _text_cache.popitem(last=False)
+
+    return _text_cache[key]
+
+
+def prerender_feedback(settings):
+    # Lay out every possible performance score before the experiment starts
+    for performance in range(101):
+        get_text_stim(f"{performance}", settings, (0, settings["deg2pix"](0.7)))
+
 
-    textstim.draw()
+def show_text(input, settings, pos=(0, 0), colour="#ffffff"):
+    get_text_stim(input, settings, pos, colour).draw()
@@ -0,0 +1,206 @@
+"""
+This file contains the functions necessary for
+running the experiment without a screen, keyboard or real time passing.
+Flips are simulated at a fixed refresh rate and only advance a virtual clock,
+so a full session runs in seconds (e.g. on a headless Linux box).
+To run the 'unpredictable flickering null-cue experiment', see main.py.
+
+made by Anna van Harmelen, 2024
+"""
+
+from math import floor
+from types import SimpleNamespace
+
+
+class VirtualClock:
+    """
+    Stands in for time() and core.wait(), but only moves when told to.
+    Like core.monotonicClock, it counts from when it was reset, `epoch` seconds
+    into the timeline that key presses are timestamped on.
+    """
+
+    def __init__(self, epoch=0.0) -> None:
+        self.now = 0.0
+        self.epoch = epoch
+
+    def time(self):
+        return self.now
+
+    def getLastResetTime(self):
+        return self.epoch
+
+    def wait(self, seconds):
+        self.now += max(seconds, 0)
+
+
+class VirtualWindow:
+    """
+    Stands in for a psychopy.visual.Window.
+    Every flip waits for the next (virtual) screen refresh and returns its time.
+    Stimuli drawn since the last flip are kept in `drawn`, those on screen after
+    the last flip in `on_screen`. Functions in `on_flip` are called after every flip.
+    """
+
+    def __init__(self, size, color, refresh_rate, clock: VirtualClock) -> None:
+        self.size = size
+        self.color = color
+        self.units = "pix"
+        self.refresh_rate = refresh_rate
+        self.clock = clock
+        self.n_flips = 0
+        self.drawn = []
+        self.on_screen = []
+        self.on_flip = []
+
+    def flip(self, clearBuffer=True):
+        # Go to the next refresh, also if we're exactly on one now
+        self.clock.now = (
+            floor(self.clock.now * self.refresh_rate + 1e-9) + 1
+        ) / self.refresh_rate
+        self.n_flips += 1
+
+        self.on_screen = self.drawn
+        if clearBuffer:
+            self.drawn = []
+
+        for function in self.on_flip:
+            function(self)
+
+        return self.clock.now
+
+    def clearBuffer(self):
+        self.drawn = []
+
+    def getActualFrameRate(self):
+        return self.refresh_rate
+
+    def close(self):
+        pass
+
+
+class VirtualStimulus:
+    """Stands in for any psychopy.visual stimulus: it keeps its settings and draws nothing."""
+
+    def __init__(self, win: VirtualWindow, **kwargs) -> None:
+        self.win = win
+        self.__dict__.update(kwargs)
+
+    def draw(self):
+        self.win.drawn.append(self)
+
+
+class Circle(VirtualStimulus):
+    pass
+
+
+class Rect(VirtualStimulus):
+    pass
+
+
+class TextStim(VirtualStimulus):
+    pass
+
+
+# Use in place of the psychopy.visual module
+visual = SimpleNamespace(Circle=Circle, Rect=Rect, TextStim=TextStim)
+
+
+class VirtualKeyPress:
+    """Stands in for a psychopy.hardware.keyboard.KeyPress."""
+
+    def __init__(self, name, tDown, rt, flip_at_press, hold_frames) -> None:
+        self.name = name
+        self.tDown = tDown
+        self.rt = rt
+        self.flip_at_press = flip_at_press
+        self.hold_frames = hold_frames
+        self.duration = None
+
+
+class VirtualKeyboard:
+    """
+    Stands in for a psychopy.hardware.keyboard.Keyboard.
+    Every key is pressed `reaction_time` seconds after it's asked for and released
+    after `hold_frames` flips. In both practice parts, Q is pressed after
+    `practice_rounds` responses, otherwise the first allowed key is pressed.
+    Subclass and override `choose_key`, `get_reaction_time` and `get_hold_frames`
+    for a more realistic participant (see simulated_participant.py).
+    """
+
+    def __init__(
+        self, window: VirtualWindow, reaction_time=0.3, hold_frames=1, practice_rounds=0
+    ):
+        self.window = window
+        self.clock = SimpleNamespace(getLastResetTime=lambda: 0.0)
+        self.reaction_time = reaction_time
+        self.hold_frames = hold_frames
+        self.practice_rounds = practice_rounds
+        self.practice_parts_left = 2
+        self.responses_in_part = 0
+        self.held = []
+
+    def is_done_practising(self, key_list):
+        # Q is only allowed while the dial is waiting for a response
+        if "q" not in key_list or not self.practice_parts_left:
+            return False
+
+        if self.responses_in_part < self.practice_rounds:
+            self.responses_in_part += 1
+            return False
+
+        self.practice_parts_left -= 1
+        self.responses_in_part = 0
+        return True
+
+    def choose_key(self, key_list):
+        if self.is_done_practising(key_list):
+            return "q"
+
+        return key_list[0]
+
+    def get_reaction_time(self, key_list):
+        return self.reaction_time
+
+    def get_hold_frames(self, key):
+        return self.hold_frames
+
+    def waitKeys(self, keyList, waitRelease=False, clear=True):
+        self.window.clock.wait(self.get_reaction_time(keyList))
+
+        # Like a real keyboard, time presses on the timeline and relative to its clock
+        key = self.choose_key(keyList)
+        t_down = self.window.clock.getLastResetTime() + self.window.clock.time()
+        press = VirtualKeyPress(
+            key,
+            t_down,
+            t_down - self.clock.getLastResetTime(),
+            self.window.n_flips,
+            self.get_hold_frames(key),
+        )
+
+        if not clear:
+            self.held.append(press)
+
+        return [press]
+
+    def getKeys(self, keyList=None, waitRelease=True, clear=True):
+        released = [
+            press
+            for press in self.held
+            if (keyList is None or press.name in keyList)
+            and self.window.n_flips - press.flip_at_press >= press.hold_frames
+        ]
+
+        for press in released:
+            press.duration = (
+                self.window.clock.getLastResetTime()
+                + self.window.clock.time()
+                - press.tDown
+            )
+            if clear:
+                self.held.remove(press)
+
+        return released
+
+    def clearEvents(self):
+        self.held = []